@@ -26,6 +26,10 @@ export function BoardWithOptions(gameOptions) {
     constructor(props) {
       super(props);
       this.state = {selectedCountry: null};
+      // id the AI server gave the map, sent instead of the adjacency list once known
+      this.mapId = null;
+      // identifies this game to the AI server, a newer request of a game replaces the older one
+      this.gameId = Math.random().toString(36).slice(2);
     }
 
     componentDidMount() {
@@ -55,7 +59,11 @@ export function BoardWithOptions(gameOptions) {
 
       const currentPlayer = gameOptions.players[+this.props.ctx.currentPlayer];
       if (currentPlayer.isAI) {
-        const data = {"G": this.props.G, "ctx": this.props.ctx, "agent": currentPlayer.name, "adjacencyList": gameMap.adjacencyList};
+        const data = {"G": this.props.G, "ctx": this.props.ctx, "agent": currentPlayer.name, "game_id": this.gameId};
+        if (this.mapId)
+          data["map_id"] = this.mapId;
+        else
+          data["adjacencyList"] = gameMap.adjacencyList;
         axios({
           url: `${AI_SERVER_REQUEST_URL}`,
           method: "post",
@@ -70,7 +78,15 @@ export function BoardWithOptions(gameOptions) {
         .then(response => {
             this.handleAIMovesResponse(response);
         })
-        .catch(error => alert(error))
+        .catch(error => {
+          // the server forgot the map, send the whole adjacency list again
+          if (error.response && error.response.status === 404 && this.mapId) {
+            this.mapId = null;
+            this.requestAIMove();
+          } else {
+            alert(error);
+          }
+        })
       }
     }
 
@@ -80,6 +96,7 @@ export function BoardWithOptions(gameOptions) {
         console.log(response.data);
       }
       const json = JSON.parse(response.data);
+      this.mapId = json['map_id'] || null;
       var moves = json['moves'];
       console.log(moves);
       this.simulateAIMoves(moves);
@@ -7,9 +7,47 @@ from collections import defaultdict
 from enum import Enum
 from math import ceil, floor
 from heap import Heap
-from copy import deepcopy
+from compact import CompactState
+from topology import topology_of
+from transposition import TranspositionTable, TABLE_SIZE, EXACT, LOWER, UPPER
+import zobrist
+import bsr
+import combat
+import book
+import value_model
+import os
+import time
+import engine
+import parallel
+from sessions import sessions, ENTRY_BYTES
+from instrumentation import RequestMetrics, TRACE_EVERY
+from mcts import MCTS, END_TURN
 
 inf = 1000000000
+# plies searched by minimax when the request has no time budget
+MINIMAX_DEPTH = 5
+# deepest iteration of iterative deepening when it has a time budget
+MAX_DEEPENING_DEPTH = 64
+# random playouts of the mcts agent when the request does not ask for a number
+MCTS_PLAYOUTS = 2000
+# choice plies searched by expectiminimax when the request has no time budget
+EXPECTIMINIMAX_DEPTH = 3
+# bounds of Problem.eval, which the chance node pruning of expectiminimax relies on
+EVAL_MIN, EVAL_MAX = -1, 1
+# attacks a planned turn chains at most when the request does not ask for a number,
+# and the attacks tried at every step of the plan
+PLAN_MAX_ATTACKS = 6
+PLAN_BRANCHING = 3
+# share of the time budget the search gets when the turn is planned, the rest is for the plan
+PLAN_SEARCH_SHARE = 0.8
+# memory an informed search may use when the request does not set memory_limit_mb, unbounded when unset
+MEMORY_LIMIT_MB = os.environ.get('RISK_MEMORY_LIMIT_MB')
+# approximate size of a frontier node: the Node, its heap entry and its position by key
+FRONTIER_NODE_BYTES = 400
+# share of a memory limit given to the table of expanded boards, the rest is for the frontier
+EXPANDED_SHARE = 0.25
+# share of the frontier cap kept when the frontier is pruned
+PRUNE_KEEP = 0.75
 
 # Flags used later, defined by Enums here
 class Player(Enum):
@@ -25,24 +63,39 @@ class Informed(Enum):
     A_STAR_REALTIME = 1
     GREEDY = 2
 
+# raised inside a search when the request's time budget is used up
+class SearchTimeout(Exception):
+    pass
+
 class State:
     def __init__(self, data):
         self.current_player = str(data['ctx']['currentPlayer'])
         self.cities = data['G']['countries']
-        self.adj_list = data['adjacencyList']
-        for city in self.adj_list:
-            self.adj_list[city] = [str(x) for x in self.adj_list[city]]
+        # the map's topology is cached across requests, its adjacency lists are shared
+        self.topology = topology_of(data)
+        self.adj_list = self.topology.adj_list
         self.agent = data['agent']
         self.phase = data['ctx']['phase']
         self.unassigned_units = data['G']['unassignedUnits'][self.current_player]
         self.dict_player_cities, self.dict_city_troops = self.seperate_cities()
+        self.dict_city_owner = self.get_city_owners()
         self.opponent_adj_list = self.get_opponent_neighbours()
+        # the cities of every player bordering an opponent, kept up to date with opponent_adj_list
+        self.border_cities = self.get_border_cities()
+        # rank of every city in the lists of dict_player_cities, a captured city goes last
+        self.city_order = {city_id: order for order, city_id in enumerate(self.cities)}
+        self.next_order = len(self.city_order)
+        self.reverse_adj_list = self.topology.reverse_adj_list
+        # Zobrist hash of the board, kept up to date by set_troops and apply_attack
+        self.hash = zobrist.board_hash(self.dict_city_owner, self.dict_city_troops)
+        # one entry per applied attack, holding what is needed to undo it
+        self.move_stack = []
+        # values derived from the current board (actions, heuristic, eval), see cached
+        self.board_cache = {}
 
     # given a city's id, it returns its owner (player_id)
     def get_player_of_city(self, city_id):
-        for owner in self.dict_player_cities:
-            if city_id in self.dict_player_cities[owner]:
-                return owner
+        return self.dict_city_owner.get(city_id)
 
     # returns a list of cities not occupied by the current player
     def get_opponent_cities(self):
@@ -85,6 +138,10 @@ class State:
             dict_id_troop[city_id] = self.cities[city_id]['soldiers']
         return dict(match_owner_cities_id), dict_id_troop
 
+    # array-backed copy of the board, see CompactState
+    def to_compact(self):
+        return CompactState.from_state(self, self.topology)
+
     def get_opponent_neighbours(self):
         opponent_adj_list = defaultdict(list)
         for city_id in self.adj_list:
@@ -93,11 +150,145 @@ class State:
                     opponent_adj_list[city_id].append(neighbour_id)
         return dict(opponent_adj_list)
 
+    def get_border_cities(self):
+        border_cities = {player: set() for player in self.dict_player_cities}
+        for city_id in self.opponent_adj_list:
+            border_cities.setdefault(self.get_player_of_city(city_id), set()).add(city_id)
+        return border_cities
 
+    # the player's cities bordering an opponent, in the order of dict_player_cities
+    def get_border_list(self, player):
+        return sorted(self.border_cities.get(player, ()), key=self.city_order.__getitem__)
+
+    def get_city_owners(self):
+        dict_city_owner = {}
+        for owner in self.dict_player_cities:
+            for city_id in self.dict_player_cities[owner]:
+                dict_city_owner[city_id] = owner
+        return dict_city_owner
+
+    # sets the troops of a city, remembering the old value
+    # if a move is being recorded so that it can be undone
+    def set_troops(self, city_id, troops):
+        if self.move_stack:
+            changed_troops = self.move_stack[-1]['troops']
+            if city_id not in changed_troops:
+                changed_troops[city_id] = self.dict_city_troops[city_id]
+        owner = self.dict_city_owner.get(city_id)
+        self.hash ^= zobrist.key(city_id, owner, self.dict_city_troops[city_id]) ^ zobrist.key(city_id, owner, troops)
+        self.dict_city_troops[city_id] = troops
+        self.board_cache = {}
+
+    # the current player captures city2 from city1 in place,
+    # returns the number of defending troops that died
+    def apply_attack(self, city1, city2):
+        owner = self.get_player_of_city(city2)
+        self.move_stack.append({
+            'troops': {},
+            'borders': {},
+            'city': city2,
+            'owner': owner,
+            'index': self.dict_player_cities[owner].index(city2),
+            'unassigned_units': self.unassigned_units,
+            'hash': self.hash,
+            'board_cache': self.board_cache,
+            'order': self.city_order[city2]
+        })
+        self.board_cache = {}
+        died_troops = self.dict_city_troops[city2]
+        self.set_troops(city1, self.dict_city_troops[city1] - died_troops)
+        self.set_troops(city2, 0)
+        self.hash ^= zobrist.key(city2, owner, 0) ^ zobrist.key(city2, self.current_player, 0)
+        self.dict_city_owner[city2] = self.current_player
+        # append to the new player
+        self.dict_player_cities[self.current_player].append(city2)
+        # remove from the old player
+        del self.dict_player_cities[owner][self.move_stack[-1]['index']]
+        self.city_order[city2] = self.next_order
+        self.next_order += 1
+        self.border_cities[owner].discard(city2)
+        self.update_borders(city2)
+        return died_troops
+
+    # an attack from city1 that fails to take city2, leaving the given troops in both,
+    # reverted by undo like apply_attack
+    def apply_repulse(self, city1, city2, troops1, troops2):
+        self.move_stack.append({
+            'troops': {},
+            'borders': {},
+            'city': None,
+            'unassigned_units': self.unassigned_units,
+            'hash': self.hash,
+            'board_cache': self.board_cache
+        })
+        self.board_cache = {}
+        self.set_troops(city1, troops1)
+        self.set_troops(city2, troops2)
+
+    # reverts the last applied attack and every troop change made after it
+    def undo(self):
+        move = self.move_stack.pop()
+        for city_id in move['troops']:
+            self.dict_city_troops[city_id] = move['troops'][city_id]
+        if move['city'] is not None:
+            self.dict_player_cities[self.current_player].pop()
+            self.dict_player_cities[move['owner']].insert(move['index'], move['city'])
+            self.dict_city_owner[move['city']] = move['owner']
+            self.border_cities[self.current_player].discard(move['city'])
+            self.city_order[move['city']] = move['order']
+            self.next_order -= 1
+        for city_id in move['borders']:
+            border_cities = self.border_cities.setdefault(self.get_player_of_city(city_id), set())
+            if move['borders'][city_id] is None:
+                self.opponent_adj_list.pop(city_id, None)
+                border_cities.discard(city_id)
+            else:
+                self.opponent_adj_list[city_id] = move['borders'][city_id]
+                border_cities.add(city_id)
+        self.unassigned_units = move['unassigned_units']
+        self.hash = move['hash']
+        self.board_cache = move['board_cache']
+
+    # cities whose troops changed since the last applied attack,
+    # the captured city is always one of them
+    def changed_cities(self):
+        return list(self.move_stack[-1]['troops'])
+
+    # recomputes the opponent neighbours of the cities
+    # whose borders change when the given city changes its owner
+    def update_borders(self, city_id):
+        changed_borders = self.move_stack[-1]['borders'] if self.move_stack else {}
+        touched = [city_id] + self.adj_list.get(city_id, []) + self.reverse_adj_list.get(city_id, [])
+        for touched_id in touched:
+            if touched_id not in self.adj_list or touched_id in changed_borders:
+                continue
+            changed_borders[touched_id] = self.opponent_adj_list.get(touched_id)
+            owner = self.get_player_of_city(touched_id)
+            opponents = [x for x in self.adj_list[touched_id] if self.get_player_of_city(x) != owner]
+            border_cities = self.border_cities.setdefault(owner, set())
+            if opponents:
+                self.opponent_adj_list[touched_id] = opponents
+                border_cities.add(touched_id)
+            else:
+                self.opponent_adj_list.pop(touched_id, None)
+                border_cities.discard(touched_id)
+
+
+    # the value named name of the current board, computed by compute() on first use
+    # and kept until the board changes, undo brings back the parent board's values
+    def cached(self, name, compute):
+        if name not in self.board_cache:
+            self.board_cache[name] = compute()
+        return self.board_cache[name]
+
+
+# nodes only hold the action leading to them and a link to their parent,
+# their boards are rebuilt on the shared search state when needed
 class Node:
+    __slots__ = ('state', 'parent', 'action', 'path_cost', 'depth')
+
     def __init__(self, state, parent, action, path_cost, depth):
         self.state = state
-        self.children = dict()
         self.parent = parent
         self.action = action
         self.path_cost = path_cost
@@ -108,10 +299,58 @@ class Node:
 
 
 class Agent:
-    def __init__(self, data):
-        self.state = State(data)
+    def __init__(self, data, solve=True, cancel=None, root_bsr=None):
+        self.data = data
+        # BSR of the border cities of the board as sent, when the caller already has them
+        self.root_bsr = root_bsr
+        # counters and timings of this request, see instrumentation.py
+        self.metrics = RequestMetrics(data)
+        with self.metrics.phase('parse'):
+            self.state = State(data)
         self.function = Functions()
-        self.problem = Problem()
+        # the leaf evaluator asked for with "evaluator", None for Problem.eval's own, see value_model.py
+        self.evaluator = value_model.evaluator_for(data, self.state.topology)
+        self.problem = Problem(self.evaluator)
+        self.transpositions = TranspositionTable()
+        self.depth_limit = MINIMAX_DEPTH
+        self.depth_limit_reached = False
+        # move ordering state of alpha-beta: killer moves per depth and history scores
+        self.move_ordering = True
+        self.killers = {}
+        self.history = {}
+        self.nodes_expanded = 0
+        self.cutoffs = 0
+        self.max_depth = 0
+        # the dice tables of the board's armies are built before the clock starts, see combat.prepare
+        if solve and self.state.agent == 'expectiminimax' and self.state.phase == engine.WAR:
+            combat.prepare(max(self.state.dict_city_troops.values(), default=0))
+        # optional per-request wall-clock budget
+        self.deadline = None
+        if data.get('time_budget_ms') is not None:
+            self.deadline = time.time() + float(data['time_budget_ms']) / 1000
+        # with "plan_turn" a war turn answers with a chain of attacks instead of one, see plan_attacks
+        self.plan_turn = bool(data.get('plan_turn'))
+        self.plan_deadline = self.deadline
+        if self.plan_turn and self.deadline is not None:
+            self.deadline = time.time() + float(data['time_budget_ms']) / 1000 * PLAN_SEARCH_SHARE
+        # threading.Event set by the service when a newer request replaces this one
+        self.cancel = cancel
+        # worker processes of a root-parallel search, 1 searches in this process
+        self.workers = parallel.worker_count(data)
+        # cost of the node returned by the last informed search
+        self.result_cost = None
+        # frontier nodes and expanded boards an informed search keeps, see search_limits
+        self.frontier_cap, self.expanded_size = search_limits(data)
+        self.pruned = 0
+        self.book_hits = 0
+        # minimax tables kept between the turns of a game that sends a game_id, see sessions.py.
+        # Only the War phase searches, the opening requests leave the session alone
+        self.session = sessions.checkout(data) if solve and self.state.agent == 'minimax' and self.state.phase == engine.WAR else None
+        if self.session is not None:
+            self.transpositions = self.session.transpositions
+            self.history = self.session.history
+        # the table of a session counts over all of its requests
+        self.tt_counts = (self.transpositions.hits, self.transpositions.misses)
         self.agents = {
             'passive': self.passive_agent,
             'pacifist': self.pacifist_agent,
@@ -119,21 +358,60 @@ class Agent:
             'greedy': self.greedy_agent,
             'A_star': self.A_star_agent,
             'A_star_realtime': self.A_star_realtime_agent,
-            'minimax': self.minimax
+            'minimax': self.minimax,
+            'mcts': self.mcts_agent,
+            'expectiminimax': self.expectiminimax_agent
         }
-        self.target_list = self.agents.get(self.state.agent)()
-        print('THE TARGET LIST =', self.target_list)
+        if solve:
+            try:
+                self.target_list = self.agents.get(self.state.agent)()
+            finally:
+                if self.session is not None:
+                    sessions.checkin(self.session)
+                self.finish_metrics()
+
+    def finish_metrics(self):
+        counters = self.metrics.counters
+        counters['nodes'] = self.nodes_expanded
+        counters['cutoffs'] = self.cutoffs
+        counters['tt_hits'] = self.transpositions.hits - self.tt_counts[0]
+        counters['tt_misses'] = self.transpositions.misses - self.tt_counts[1]
+        counters['heuristic_calls'] = self.function.heuristic_calls + self.problem.function.heuristic_calls
+        counters['depth'] = self.max_depth
+        counters['pruned'] = self.pruned
+        counters['book_hits'] = self.book_hits
+        self.metrics.finish()
 
     def return_format(self, move_list):
-        response = defaultdict(list)
-        for tup in move_list:
-            response['moves'].append({'name': tup[0], 'sourceId': tup[1], 'destId': tup[2], 'numSoldiers': tup[3]})
-        return json.dumps(response)
+        with self.metrics.phase('format'):
+            response = defaultdict(list)
+            for tup in move_list:
+                response['moves'].append({'name': tup[0], 'sourceId': tup[1], 'destId': tup[2], 'numSoldiers': tup[3]})
+            # lets the client send the map_id instead of the adjacencyList from now on
+            response['map_id'] = self.state.topology.map_id
+            return json.dumps(response)
 
     def occupy(self):
-        country_to_occupy =  self.state.dict_player_cities[None][0]
+        country_to_occupy = self.book_move() or self.state.dict_player_cities[None][0]
         return self.return_format([("occupy", country_to_occupy, 0, 1)])
 
+    # the unit of a Reinforce Countries turn of the search agents
+    def reinforce_opening(self):
+        city = self.book_move()
+        if city is not None:
+            return self.return_format([("reinforce", city, 0, 1)])
+        return self.return_format(ai_reinforce(self.state, 1))
+
+    # the placement of the map's opening book for the board, None when the
+    # map has no book, the board is not in it or the payload sends "book": false
+    def book_move(self):
+        if not self.data.get('book', True):
+            return None
+        city = book.lookup(self.state)
+        if city is not None:
+            self.book_hits += 1
+        return city
+
     def reinforce_weakest(self):
         weakest_city = self.state.get_city(Player.CURRENT, Troops.MIN)
         return self.return_format([("reinforce", weakest_city, 0, 1)])
@@ -143,16 +421,7 @@ class Agent:
         return self.return_format([("reinforce", strongest_city, 0, 1)])
 
     def redistribute_troops(self, city1, city2):
-        died_troops = self.state.dict_city_troops[city2] # troops that will die
-        self.state.dict_city_troops[city1] -= died_troops
-        self.state.dict_city_troops[city2] = 0
-        owner = self.state.get_player_of_city(city2)
-        # append to the new player
-        self.state.dict_player_cities[self.state.current_player].append(city2)
-        # remove from the old player
-        self.state.dict_player_cities[owner].remove(city2)
-        # invert opponent lists
-        self.state.opponent_adj_list = self.state.get_opponent_neighbours()
+        self.state.apply_attack(city1, city2)
         # redistribute troops
         try:
             bsr1 = self.function.BSR_(self.state, city1, self.state.opponent_adj_list[city1], 1)
@@ -169,10 +438,10 @@ class Agent:
         val = self.state.dict_city_troops[city1]
         val1 = floor(val * nbsr1) if floor(val * nbsr1) >= 1 else 1
         if val > val1:
-            self.state.dict_city_troops[city1] = val1
+            self.state.set_troops(city1, val1)
         else: # val = val1
-            self.state.dict_city_troops[city1] = val1 - 1
-        self.state.dict_city_troops[city2] = val - self.state.dict_city_troops[city1]
+            self.state.set_troops(city1, val1 - 1)
+        self.state.set_troops(city2, val - self.state.dict_city_troops[city1])
         return self.state.dict_city_troops[city2]
 
     def passive_agent(self):
@@ -192,7 +461,7 @@ class Agent:
             return self.reinforce_weakest()
         elif self.state.phase == "War":
             weakest_city = self.state.get_city(Player.CURRENT, Troops.MIN) # to reinforce
-            self.state.dict_city_troops[weakest_city] += self.state.unassigned_units
+            self.state.set_troops(weakest_city, self.state.dict_city_troops[weakest_city] + self.state.unassigned_units)
             # during war, it attacks an opponent city which has least troops (if it can)
             opponent_cities = self.state.get_opponent_cities() # current player's nonoccupied cities
             opponent_troops = self.state.get_troops_of_cities(opponent_cities)
@@ -224,81 +493,428 @@ class Agent:
       if self.state.phase == "Occupation":
         return self.occupy()
       elif self.state.phase == "Reinforce Countries":
-        return self.return_format(ai_reinforce(self.state, 1))
+        return self.reinforce_opening()
       elif self.state.phase == "War":
-        moves = ai_reinforce(self.state, self.state.unassigned_units)
-        node = Node(self.state, None, None, 0, 0)
-        child, _ = self._maximize(node, -inf, inf, 0)
-        attack = self.back_track(child)
-        moves.append(("attack", attack[0], attack[1], self.redistribute_troops(attack[0], attack[1])))
+        moves = self.reinforce_root()
+        with self.metrics.phase('search'):
+          if self.workers > 1:
+            child = self.parallel_minimax()
+          elif self.deadline is None:
+            child, _ = self._maximize(Node(self.state, None, None, 0, 0), -inf, inf, 0)
+          else:
+            child = self.iterative_deepening()
+        attack = self.back_track(child) if child is not None else []
+        if self.plan_turn:
+          moves = self.plan_attacks(moves, attack)
+        elif attack:
+          moves.append(("attack", attack[0], attack[1], self.redistribute_troops(attack[0], attack[1])))
         return self.return_format(moves)
       return self.return_format([("can't find any moves", 0, 0, self.state.unassigned_units)])
 
+    # war phase reinforcement every search agent starts its turn with
+    def reinforce_root(self):
+      with self.metrics.phase('reinforce'):
+        return ai_reinforce(self.state, self.state.unassigned_units, self.root_bsr)
+
+    # splits the root actions over the worker pool
+    # and picks the child with the highest minimax value
+    def parallel_minimax(self):
+      root = Node(self.state, None, None, 0, 0)
+      if self.problem.minimax_goal_test(self.state) != 0:
+        return None
+      actions = self.ordered_actions(None, 0)
+      if not actions:
+        return None
+      results, self.nodes_expanded = parallel.minimax_root(self.worker_data(), actions, self.workers)
+      best, best_rank = None, None
+      for idx, (action, value, exact) in enumerate(results):
+        # ties go to the exact value and then to the better ordered action, as in the serial search
+        rank = (value, exact, -idx)
+        if best_rank is None or rank > best_rank:
+          best, best_rank = action, rank
+      # no worker finished a single ply in time
+      if best is None:
+        best = actions[0]
+      return Node(None, root, best, 0, 1)
+
+    # the payload sent to the workers: it carries what is left of the time budget and
+    # the worker's share of the memory limit, and always the adjacency list since
+    # every worker process has a map registry of its own
+    def worker_data(self):
+      data = dict(self.data, adjacencyList=self.state.adj_list, plan_turn=False)
+      if self.deadline is not None:
+        data['time_budget_ms'] = max(self.deadline - time.time(), 0) * 1000
+      if memory_limit_mb(self.data) is not None:
+        data['memory_limit_mb'] = memory_limit_mb(self.data) / self.workers
+      return data
+
+    # minimax values of the given root actions searched one after the other with a shared alpha,
+    # returns [(action, value, exact)] where exact is False for values that are only upper bounds
+    def search_root_actions(self, actions):
+      root = Node(self.state, None, None, 0, 0)
+      limits = [self.depth_limit] if self.deadline is None else range(1, MAX_DEEPENING_DEPTH + 1)
+      results = []
+      for depth_limit in limits:
+        self.depth_limit = depth_limit
+        self.depth_limit_reached = False
+        values, alpha = [], -inf
+        try:
+          for action in actions:
+            child = self.problem.apply_child(root, action, self.state)
+            _, util = self._minimize(child, alpha, inf, 1)
+            self.state.undo()
+            values.append((action, util, util > alpha))
+            alpha = max(alpha, util)
+        except SearchTimeout:
+          while self.state.move_stack:
+            self.state.undo()
+          break
+        results = values
+        if not self.depth_limit_reached:
+          break
+      return results
+
+    # searches one ply deeper at a time until the time budget runs out and returns
+    # the best child of the last completed depth, the transposition table carries
+    # each iteration's best line over to the next one where it is tried first
+    def iterative_deepening(self):
+      best_child = None
+      for depth_limit in range(1, MAX_DEEPENING_DEPTH + 1):
+        self.depth_limit = depth_limit
+        self.depth_limit_reached = False
+        try:
+          child, _ = self._maximize(Node(self.state, None, None, 0, 0), -inf, inf, 0)
+        except SearchTimeout:
+          while self.state.move_stack:
+            self.state.undo()
+          # not even one ply finished, fall back to the first legal action
+          if best_child is None:
+            actions = self.problem.get_actions(self.state)
+            if actions:
+              best_child = Node(None, Node(self.state, None, None, 0, 0), actions[0], 0, 1)
+          break
+        best_child = child
+        self.metrics.event('iteration', depth=depth_limit, nodes=self.nodes_expanded, move=child.action if child else None)
+        # the whole tree fitted below this limit, deeper iterations find nothing new
+        if not self.depth_limit_reached:
+          break
+      return best_child
+
+    # True once the time budget is used up or the request was cancelled
+    def out_of_time(self):
+      if self.cancel is not None and self.cancel.is_set():
+        return True
+      return self.deadline is not None and time.time() > self.deadline
+
+    def check_deadline(self):
+      if self.out_of_time():
+        raise SearchTimeout()
+
     def _minimize(self, node, alpha, beta, depth):
-      print("minimize")
-      goal_test = self.problem.minimax_goal_test(node.state)
+      self.check_deadline()
+      self.nodes_expanded += 1
+      if depth > self.max_depth:
+        self.max_depth = depth
+      if self.metrics.trace and self.nodes_expanded % TRACE_EVERY == 0:
+        self.metrics.event('node', side='min', depth=depth, alpha=alpha, beta=beta, nodes=self.nodes_expanded)
+      goal_test = self.problem.minimax_goal_test(self.state)
       if  goal_test != 0:
-        print("min goal test true")
         return None, goal_test
 
-      if self.problem.leaf_test(node.state):
-        return node, self.problem.eval(node.state)
-
-      if depth >= 5:
-        return node, self.problem.eval(node.state)
+      # positions are stored with the side to move mixed into their hash
+      board_hash = self.state.hash ^ zobrist.SIDE_KEY
+      entry = self.transpositions.probe(board_hash)
+      value = self.transpositions.cutoff(entry, self.depth_limit - depth, alpha, beta)
+      if value is not None:
+        if entry.depth < inf:
+          self.depth_limit_reached = True
+        return node, value
+
+      if self.problem.leaf_test(self.state):
+        value = self.problem.eval(self.state)
+        self.transpositions.store(board_hash, inf, value)
+        return node, value
+
+      if depth >= self.depth_limit:
+        self.depth_limit_reached = True
+        value = self.problem.eval(self.state)
+        self.transpositions.store(board_hash, 0, value)
+        return node, value
 
       minChild, minUtil = None, inf
+      beta0 = beta
 
-      for action in self.problem.get_actions(node.state):
-        child = self.problem.child_node(node, action)
+      actions = self.ordered_actions(entry, depth)
+      if self.evaluator is not None and depth + 1 >= self.depth_limit:
+        minChild, minUtil = self.score_frontier(node, actions, min, depth)
+        self.transpositions.store(board_hash, self.depth_limit - depth, minUtil, EXACT, minChild.action)
+        return minChild, minUtil
 
+      for action in actions:
+        child = self.problem.apply_child(node, action, self.state)
         _, util = self._maximize(child, alpha, beta, depth + 1)
+        self.state.undo()
 
         if util < minUtil:
           minChild, minUtil = child, util
 
         if minUtil <= alpha:
+          self.record_cutoff(action, depth)
           break
 
         if minUtil < beta:
           beta = minUtil
 
+      flag = UPPER if minUtil <= alpha else LOWER if minUtil >= beta0 else EXACT
+      self.transpositions.store(board_hash, self.depth_limit - depth, minUtil, flag, minChild.action if minChild else None)
       return minChild, minUtil
 
     def _maximize(self, node, alpha, beta, depth):
-      print("maximize")
-
-      goal_test = self.problem.minimax_goal_test(node.state)
+      self.check_deadline()
+      self.nodes_expanded += 1
+      if depth > self.max_depth:
+        self.max_depth = depth
+      if self.metrics.trace and self.nodes_expanded % TRACE_EVERY == 0:
+        self.metrics.event('node', side='max', depth=depth, alpha=alpha, beta=beta, nodes=self.nodes_expanded)
+
+      goal_test = self.problem.minimax_goal_test(self.state)
       if  goal_test != 0:
-        print("max goal test true")
         return None, goal_test
 
-      if self.problem.leaf_test(node.state):
-        return node, self.problem.eval(node.state)
-
-      if depth >= 5:
-        print("depth limit reached")
-        return node, self.problem.eval(node.state)
+      board_hash = self.state.hash
+      entry = self.transpositions.probe(board_hash)
+      # the root always searches so that there is a child to return
+      value = self.transpositions.cutoff(entry, self.depth_limit - depth, alpha, beta) if depth > 0 else None
+      if value is not None:
+        if entry.depth < inf:
+          self.depth_limit_reached = True
+        return node, value
+
+      if self.problem.leaf_test(self.state):
+        value = self.problem.eval(self.state)
+        self.transpositions.store(board_hash, inf, value)
+        return node, value
+
+      if depth >= self.depth_limit:
+        self.depth_limit_reached = True
+        value = self.problem.eval(self.state)
+        self.transpositions.store(board_hash, 0, value)
+        return node, value
 
       maxChild, maxUtil = None, -inf
+      alpha0 = alpha
 
-      print(self.problem.get_actions(node.state))
+      actions = self.ordered_actions(entry, depth)
+      if self.evaluator is not None and depth + 1 >= self.depth_limit:
+        maxChild, maxUtil = self.score_frontier(node, actions, max, depth)
+        self.transpositions.store(board_hash, self.depth_limit - depth, maxUtil, EXACT, maxChild.action)
+        return maxChild, maxUtil
 
-      for action in self.problem.get_actions(node.state):
-        child = self.problem.child_node(node, action)
+      for action in actions:
+        child = self.problem.apply_child(node, action, self.state)
         _, util = self._minimize(child, alpha, beta, depth + 1)
+        self.state.undo()
 
         if util > maxUtil:
           maxChild, maxUtil = child, util
 
         if maxUtil >= beta:
+          self.record_cutoff(action, depth)
           break
 
         if maxUtil > alpha:
           alpha = maxUtil
 
+      flag = UPPER if maxUtil <= alpha0 else LOWER if maxUtil >= beta else EXACT
+      self.transpositions.store(board_hash, self.depth_limit - depth, maxUtil, flag, maxChild.action if maxChild else None)
       return maxChild, maxUtil
 
+    # the children of a node just above the depth limit, scored in one batch of the
+    # learned evaluator instead of a search call each. Returns the child that
+    # choose (min or max) picks and its value, which is exact at this depth
+    def score_frontier(self, node, actions, choose, depth):
+      compact = self.state.to_compact()
+      index = compact.topology.index
+      children, goals, changes = [], [], []
+      for action in actions:
+        self.check_deadline()
+        children.append(self.problem.apply_child(node, action, self.state))
+        goals.append(self.problem.minimax_goal_test(self.state))
+        changes.append([(index[city], int(self.state.current_player), self.state.dict_city_troops[city])
+                        for city in self.state.changed_cities()])
+        self.state.undo()
+      self.nodes_expanded += len(children)
+      self.max_depth = max(self.max_depth, depth + 1)
+      self.depth_limit_reached = True
+      values = self.evaluator.score_children(compact, changes).tolist()
+      utils = [goal if goal != 0 else value for goal, value in zip(goals, values)]
+      best = choose(range(len(children)), key=utils.__getitem__)
+      return children[best], utils[best]
+
+    # legal actions of the shared state, most promising first: the best move stored
+    # in the transposition table, then the killer moves of this depth, then by
+    # history score and finally by the attacker to defender troop ratio
+    def ordered_actions(self, entry, depth):
+      actions = self.problem.get_actions(self.state)
+      if not self.move_ordering:
+        return actions
+      tt_move = entry.move if entry is not None else None
+      killers = self.killers.get(depth, [])
+      troops = self.state.dict_city_troops
+      def rank(action):
+        source, destination = action.split('_')
+        return (action != tt_move,
+                action not in killers,
+                -self.history.get(action, 0),
+                -troops[source] / max(troops[destination], 1))
+      actions.sort(key=rank)
+      return actions
+
+    # remembers a move that caused a cutoff as a killer of its depth
+    # and rewards it in the history table, more so the shallower it was
+    def record_cutoff(self, action, depth):
+      self.cutoffs += 1
+      if not self.move_ordering:
+        return
+      killers = self.killers.setdefault(depth, [])
+      if action not in killers:
+        killers.insert(0, action)
+        del killers[2:]
+      remaining = max(self.depth_limit - depth, 1)
+      self.history[action] = self.history.get(action, 0) + remaining * remaining
+
+    # minimax over the dice model of combat.py: every attack is a chance node
+    # that is won or repulsed with the probabilities of the dice tables
+    def expectiminimax_agent(self):
+        if self.state.phase == "Occupation":
+            return self.occupy()
+        elif self.state.phase == "Reinforce Countries":
+            return self.reinforce_opening()
+        elif self.state.phase == "War":
+            moves = self.reinforce_root()
+            with self.metrics.phase('search'):
+                action = self.expectiminimax_search()
+            attack = action.split('_') if action is not None else []
+            if self.plan_turn:
+                moves = self.plan_attacks(moves, attack)
+            elif attack:
+                moves.append(("attack", attack[0], attack[1], self.redistribute_troops(attack[0], attack[1])))
+            return self.return_format(moves)
+        return self.return_format([("can't find any moves", 0, 0, self.state.unassigned_units)])
+
+    # the best root action, one ply deeper at a time while a time budget is left
+    def expectiminimax_search(self):
+        best = None
+        limits = [EXPECTIMINIMAX_DEPTH] if self.deadline is None else range(1, MAX_DEEPENING_DEPTH + 1)
+        for depth_limit in limits:
+            self.depth_limit = depth_limit
+            self.depth_limit_reached = False
+            try:
+                action, _ = self._expect_choice(True, EVAL_MIN, EVAL_MAX, 0)
+            except SearchTimeout:
+                while self.state.move_stack:
+                    self.state.undo()
+                if best is None:
+                    actions = self.problem.get_actions(self.state)
+                    best = actions[0] if actions else None
+                break
+            best = action
+            self.metrics.event('iteration', depth=depth_limit, nodes=self.nodes_expanded, move=action)
+            if not self.depth_limit_reached:
+                break
+        return best
+
+    # a node where one side picks an attack, returns (action, value)
+    def _expect_choice(self, maximizing, alpha, beta, depth):
+        self.check_deadline()
+        self.nodes_expanded += 1
+        if depth > self.max_depth:
+            self.max_depth = depth
+        goal_test = self.problem.minimax_goal_test(self.state)
+        if goal_test != 0:
+            return None, goal_test
+
+        board_hash = self.state.hash if maximizing else self.state.hash ^ zobrist.SIDE_KEY
+        entry = self.transpositions.probe(board_hash)
+        value = self.transpositions.cutoff(entry, self.depth_limit - depth, alpha, beta) if depth > 0 else None
+        if value is not None:
+            if entry.depth < inf:
+                self.depth_limit_reached = True
+            return entry.move, value
+
+        actions = self.ordered_actions(entry, depth)
+        if not actions:
+            value = self.problem.eval(self.state)
+            self.transpositions.store(board_hash, inf, value)
+            return None, value
+        if depth >= self.depth_limit:
+            self.depth_limit_reached = True
+            value = self.problem.eval(self.state)
+            self.transpositions.store(board_hash, 0, value)
+            return None, value
+
+        best_action, best = None, -inf if maximizing else inf
+        alpha0, beta0 = alpha, beta
+        for action in actions:
+            value = self._expect_chance(action, not maximizing, alpha, beta, depth)
+            if (value > best) if maximizing else (value < best):
+                best_action, best = action, value
+            if (best >= beta) if maximizing else (best <= alpha):
+                self.record_cutoff(action, depth)
+                break
+            if maximizing:
+                alpha = max(alpha, best)
+            else:
+                beta = min(beta, best)
+
+        flag = UPPER if best <= alpha0 else LOWER if best >= beta0 else EXACT
+        self.transpositions.store(board_hash, self.depth_limit - depth, best, flag, best_action)
+        return best_action, best
+
+    # value of the chance node of an attack, followed by a choice of the given side.
+    # Star1 searches every outcome with the narrowest window that can still change
+    # the result, and Star2 first probes every outcome with its first move only, which
+    # bounds a max node from below (a min node from above) and may cut off already.
+    # Both rely on the values being within [EVAL_MIN, EVAL_MAX].
+    def _expect_chance(self, action, maximizing, alpha, beta, depth):
+        outcomes = self.problem.attack_outcomes(self.state, action)
+        if len(outcomes) > 1 and depth + 1 < self.depth_limit:
+            bound = 0
+            for probability, outcome in outcomes:
+                self.problem.apply_outcome(self.state, action, outcome)
+                bound += probability * self._expect_probe(maximizing, depth + 1)
+                self.state.undo()
+            if (bound >= beta) if maximizing else (bound <= alpha):
+                self.cutoffs += 1
+                return bound
+
+        seen, remaining = 0.0, 1.0
+        for probability, outcome in outcomes:
+            remaining -= probability
+            low = (alpha - seen - EVAL_MAX * remaining) / probability
+            high = (beta - seen - EVAL_MIN * remaining) / probability
+            self.problem.apply_outcome(self.state, action, outcome)
+            _, value = self._expect_choice(maximizing, max(low, EVAL_MIN), min(high, EVAL_MAX), depth + 1)
+            self.state.undo()
+            if value <= low:
+                self.cutoffs += 1
+                return seen + probability * value + EVAL_MAX * remaining
+            if value >= high:
+                self.cutoffs += 1
+                return seen + probability * value + EVAL_MIN * remaining
+            seen += probability * value
+        return seen
+
+    # value of the first move of a choice node, a bound on the node's value
+    def _expect_probe(self, maximizing, depth):
+        goal_test = self.problem.minimax_goal_test(self.state)
+        if goal_test != 0:
+            return goal_test
+        actions = self.ordered_actions(self.transpositions.probe(self.state.hash if maximizing else self.state.hash ^ zobrist.SIDE_KEY), depth)
+        if not actions:
+            return self.problem.eval(self.state)
+        return self._expect_chance(actions[0], not maximizing, EVAL_MIN, EVAL_MAX, depth)
+
     def aggressive_agent(self):
         if self.state.phase == "Occupation":
             return self.occupy()
@@ -306,7 +922,7 @@ class Agent:
             return self.reinforce_strongest()
         elif self.state.phase == "War":
             strongest_city = self.state.get_city(Player.CURRENT, Troops.MAX)
-            self.state.dict_city_troops[strongest_city] += self.state.unassigned_units
+            self.state.set_troops(strongest_city, self.state.dict_city_troops[strongest_city] + self.state.unassigned_units)
             if strongest_city in self.state.opponent_adj_list:
                 troops_in_strongest_city = self.state.dict_city_troops[strongest_city]
                 adjacent_opponents = self.state.opponent_adj_list[strongest_city]
@@ -328,56 +944,177 @@ class Agent:
             ])
         return self.return_format([("can't find any moves", 0, 0, self.state.unassigned_units)])
 
-    def informed_search(self, informed_type):
+    # with roots, the frontier starts from the given (child, priority, key)
+    # entries instead of the root, this is how a worker searches its share
+    def informed_search(self, informed_type, roots=None):
         node = Node(self.state, None, None, 0, 0)
-        if self.problem.goal_test(node.state):
-            return node, "success"
+        self.result_cost = 0
         frontier_heap = Heap()
-        frontier_heap.add(node, priority=node.path_cost)
+        if roots is None:
+            if self.problem.goal_test(self.state):
+                return node, "success"
+            frontier_heap.add(node, priority=node.path_cost)
+        else:
+            for child, priority, key in roots:
+                self.add_to_frontier(frontier_heap, child, priority, key)
         heap_limit = Heap()
+        # boards already expanded, with the cost and remaining depth they were expanded with.
+        # Boards are identified by their Zobrist hash, which covers the exact troop
+        # counts, so boards sharing an entry or a frontier slot are equal barring a 64-bit collision
+        expanded = TranspositionTable(self.expanded_size)
         while True:
-            if not frontier_heap.pq:
+            if not len(frontier_heap):
                 if informed_type == Informed.GREEDY:
                     return node, "empty, greedy"
                 else:
-                    if not heap_limit.pq:
+                    if not len(heap_limit):
                         return None, "empty, failure"
                     else:
-                        _, min_ = heap_limit.pop()
+                        self.result_cost, min_ = heap_limit.pop()
                         return min_, "empty, reached limit"
 
+            if self.out_of_time():
+                return self.best_so_far(informed_type, frontier_heap, heap_limit), "timeout"
+
             cost, node = frontier_heap.pop()
-            if self.problem.goal_test(node.state):
+            if node.depth > self.max_depth:
+                self.max_depth = node.depth
+            # nodes only keep their action, so the board of the popped
+            # node is rebuilt on the shared state and undone afterwards
+            self.enter(node)
+            if self.problem.goal_test(self.state):
+                self.leave(node)
+                self.result_cost = cost
                 return node, "success"
 
+            # skip boards that were expanded before at no higher cost and at no larger depth
+            limit = inf if informed_type == Informed.GREEDY else 3 if informed_type == Informed.A_STAR_REALTIME else 10
+            entry = expanded.probe(self.state.hash)
+            if entry is not None and entry.value <= node.path_cost and entry.depth >= limit - node.depth:
+                self.leave(node)
+                continue
+            expanded.store(self.state.hash, limit - node.depth, node.path_cost)
+            self.nodes_expanded += 1
+            if self.metrics.trace and self.nodes_expanded % TRACE_EVERY == 0:
+                self.metrics.event('node', depth=node.depth, cost=cost, frontier=len(frontier_heap), nodes=self.nodes_expanded)
+
             if informed_type == Informed.GREEDY:
-                for action in self.problem.get_actions(node.state):
-                    child = self.problem.child_node(node, action)
-                    child_path_to_goal = self.function.total_BSR(child.state)
-                    frontier_heap.add(child, priority=child_path_to_goal)
+                for child, child_path_to_goal, key in self.expand(node, informed_type):
+                    self.add_to_frontier(frontier_heap, child, child_path_to_goal, key)
 
             else: # Informed.A_STAR_REALTIME or Informed.A_STAR_NORMAL
-                limit = 3 if informed_type == Informed.A_STAR_REALTIME else 10
                 if node.depth < limit:
-                    for action in self.problem.get_actions(node.state):
-                        child = self.problem.child_node(node, action)
-                        child_path_to_goal = self.function.total_BSR(child.state)
+                    for child, child_path_to_goal, key in self.expand(node):
                         child_total_path = child.path_cost + child_path_to_goal
-                        frontier_heap.add(child, priority=child_total_path)
+                        self.add_to_frontier(frontier_heap, child, child_total_path, key)
                 else:
                     heap_limit.add(node, priority=cost)
+                    # only the cheapest node that hit the limit is ever used
+                    heap_limit.prune(1)
+            # past the memory limit the most expensive frontier nodes are dropped
+            if self.frontier_cap is not None and len(frontier_heap) > self.frontier_cap:
+                self.pruned += frontier_heap.prune(int(self.frontier_cap * PRUNE_KEEP))
+            self.leave(node)
+
+    # generates the children of the node the shared state is at, together with
+    # their total BSR (scored in one batch) and their Zobrist hashes, which key the frontier
+    # as an exact board identity, see informed_search.
+    # With a learned evaluator the greedy search ranks them by 1 - value instead
+    def expand(self, node, informed_type=None):
+        compact = self.state.to_compact()
+        index = compact.topology.index
+        children, keys, changes = [], [], []
+        for action in self.problem.get_actions(self.state):
+            children.append(self.problem.apply_child(node, action, self.state))
+            keys.append(self.state.hash)
+            changes.append([(index[city], int(self.state.current_player), self.state.dict_city_troops[city])
+                            for city in self.state.changed_cities()])
+            self.state.undo()
+        if not children:
+            return []
+        if self.evaluator is not None and informed_type == Informed.GREEDY:
+            scores = 1 - self.evaluator.score_children(compact, changes)
+        else:
+            scores = bsr.total_bsr_children(compact, changes)
+        return zip(children, scores.tolist(), keys)
+
+    # the node to act on when the search runs out of time:
+    # the cheapest node that hit the depth limit, or else the best frontier node
+    def best_so_far(self, informed_type, frontier_heap, heap_limit):
+        if informed_type != Informed.GREEDY and len(heap_limit):
+            self.result_cost, node = heap_limit.peek()
+        else:
+            self.result_cost, node = frontier_heap.peek()
+        return node
+
+    # runs the informed search here or, with several workers, below every worker's share
+    # of the root actions, merging the results like the serial search would rank them
+    def run_informed_search(self, informed_type):
+        if self.workers <= 1 or informed_type == Informed.GREEDY or self.problem.goal_test(self.state):
+            return self.informed_search(informed_type)
+        actions = self.problem.get_actions(self.state)
+        if not actions:
+            return self.informed_search(informed_type)
+        rank = {"success": 0, "timeout": 1, "empty, reached limit": 1}
+        best = None
+        for results in parallel.informed_root(self.worker_data(), informed_type, actions, self.workers):
+            for output, cost, path in results:
+                if path is None or output not in rank:
+                    continue
+                if best is None or (rank[output], cost) < (rank[best[0]], best[1]):
+                    best = (output, cost, path)
+        if best is None:
+            return None, "empty, failure"
+        node = Node(self.state, None, None, 0, 0)
+        for action in best[2]:
+            node = Node(None, node, action, 0, node.depth + 1)
+        self.result_cost = best[1]
+        return node, best[0]
+
+    # informed search whose frontier starts from the children of the given root actions,
+    # returns [(output, cost, path)] with the actions leading to the node found
+    def search_below_root_actions(self, informed_type, actions):
+        root = Node(self.state, None, None, 0, 0)
+        roots = []
+        for child, child_path_to_goal, key in self.expand(root, informed_type):
+            if child.action in actions:
+                roots.append((child, child.path_cost + child_path_to_goal, key))
+        node, output = self.informed_search(informed_type, roots)
+        path = self.problem.path(node) if node is not None else None
+        return [(output, self.result_cost, path)]
+
+    # replays the actions leading to the node on the shared state
+    def enter(self, node):
+        for action in self.problem.path(node):
+            self.problem.apply_action(self.state, action)
+
+    # undoes what enter(node) applied
+    def leave(self, node):
+        for _ in range(node.depth):
+            self.state.undo()
+
+    # pushes a child to the frontier, or updates the frontier entry
+    # of the same board if the child reaches it more cheaply
+    def add_to_frontier(self, frontier_heap, child, priority, key):
+        if not frontier_heap.contains(key):
+            frontier_heap.add(child, priority=priority, key=key)
+        elif priority < frontier_heap.priority(key):
+            frontier_heap.decrease_key(key, priority, child)
 
     def greedy_agent(self):
         if self.state.phase == "Occupation":
             return self.occupy()
         elif self.state.phase == "Reinforce Countries":
-            return self.return_format(ai_reinforce(self.state, 1))
+            return self.reinforce_opening()
         elif self.state.phase == "War":
-            moves = ai_reinforce(self.state, self.state.unassigned_units)
-            node, output = self.informed_search(Informed.GREEDY)
-            print('========================> THE OUTPUT IS', output)
-            if output == 'success':
-                attack = self.back_track(node)
+            moves = self.reinforce_root()
+            with self.metrics.phase('search'):
+                node, output = self.informed_search(Informed.GREEDY)
+            self.metrics.event('search', output=output, cost=self.result_cost)
+            attack = self.back_track(node) if output == 'success' or output == 'timeout' else []
+            if self.plan_turn:
+                moves = self.plan_attacks(moves, attack)
+            elif attack:
                 moves.append(("attack", attack[0], attack[1], self.redistribute_troops(attack[0], attack[1])))
             return self.return_format(moves)
         return self.return_format([("can't find any moves", 0, 0, self.state.unassigned_units)])
@@ -386,13 +1123,16 @@ class Agent:
         if self.state.phase == "Occupation":
             return self.occupy()
         elif self.state.phase == "Reinforce Countries":
-            return self.return_format(ai_reinforce(self.state, 1))
+            return self.reinforce_opening()
         elif self.state.phase == "War":
-            moves = ai_reinforce(self.state, self.state.unassigned_units)
-            node, output = self.informed_search(Informed.A_STAR_NORMAL)
-            print('========================> THE OUTPUT IS', output)
-            if node != None:
-                attack = self.back_track(node)
+            moves = self.reinforce_root()
+            with self.metrics.phase('search'):
+                node, output = self.run_informed_search(Informed.A_STAR_NORMAL)
+            self.metrics.event('search', output=output, cost=self.result_cost)
+            attack = self.back_track(node) if node != None else []
+            if self.plan_turn:
+                moves = self.plan_attacks(moves, attack)
+            elif attack:
                 moves.append(("attack", attack[0], attack[1], self.redistribute_troops(attack[0], attack[1])))
             return self.return_format(moves)
         return self.return_format([("can't find any moves", 0, 0, self.state.unassigned_units)])
@@ -401,17 +1141,96 @@ class Agent:
         if self.state.phase == "Occupation":
             return self.occupy()
         elif self.state.phase == "Reinforce Countries":
-            return self.return_format(ai_reinforce(self.state, 1))
+            return self.reinforce_opening()
         elif self.state.phase == "War":
-            moves = ai_reinforce(self.state, self.state.unassigned_units)
-            node, output = self.informed_search(Informed.A_STAR_REALTIME)
-            print('========================> THE OUTPUT IS', output)
-            if node != None:
-                attack = self.back_track(node)
+            moves = self.reinforce_root()
+            with self.metrics.phase('search'):
+                node, output = self.run_informed_search(Informed.A_STAR_REALTIME)
+            self.metrics.event('search', output=output, cost=self.result_cost)
+            attack = self.back_track(node) if node != None else []
+            if self.plan_turn:
+                moves = self.plan_attacks(moves, attack)
+            elif attack:
                 moves.append(("attack", attack[0], attack[1], self.redistribute_troops(attack[0], attack[1])))
             return self.return_format(moves)
         return self.return_format([("can't find any moves", 0, 0, self.state.unassigned_units)])
 
+    def mcts_agent(self):
+        if self.state.phase == "Occupation":
+            return self.occupy()
+        elif self.state.phase == "Reinforce Countries":
+            return self.reinforce_opening()
+        elif self.state.phase == "War":
+            moves = self.reinforce_root()
+            compact = self.state.to_compact()
+            players = sorted(int(player) for player in self.data['G']['unassignedUnits'])
+            search = MCTS(compact, players, playouts=int(self.data.get('playouts', MCTS_PLAYOUTS)), deadline=self.deadline, stop=self.out_of_time)
+            with self.metrics.phase('search'):
+                edge = search.run()
+            self.nodes_expanded = search.nodes
+            if self.plan_turn:
+                topology = compact.topology
+                attack = [topology.ids[topology.sources[edge]], topology.ids[topology.indices[edge]]] if edge != END_TURN else []
+                moves = self.plan_attacks(moves, attack)
+            elif edge != END_TURN:
+                topology = compact.topology
+                source, destination = topology.sources[edge], topology.indices[edge]
+                # Game.js leaves one soldier behind and moves the rest of the survivors
+                moved = int(compact.troops[source] - compact.troops[destination] - 1)
+                moves.append(("attack", topology.ids[source], topology.ids[destination], moved))
+            return self.return_format(moves)
+        return self.return_format([("can't find any moves", 0, 0, self.state.unassigned_units)])
+
+    # plans the rest of the war turn after the reinforcement moves and the attack the
+    # agent's search found: a depth first search over chains of up to max_attacks attacks,
+    # played the way Game.js plays them with no reinforcements in between, picks the chain
+    # that ends on the best eval (the shorter one on ties). The chain is checked against
+    # engine.Game and cut at the first attack the game would refuse.
+    def plan_attacks(self, moves, first):
+        max_attacks = int(self.data.get('max_attacks', PLAN_MAX_ATTACKS))
+        chain = []
+        first = '_'.join(first)
+        if first and max_attacks > 0 and self.problem.can_attack(self.state, first):
+            self.problem.apply_turn_action(self.state, first)
+            chain.append(first)
+        with self.metrics.phase('search'):
+            _, rest = self.best_chain(max_attacks - len(chain))
+        if chain:
+            self.state.undo()
+        chain += rest
+        self.metrics.event('plan', attacks=len(chain))
+
+        game = engine.Game.from_payload(self.data, self.state.adj_list)
+        for move in moves:
+            game.apply_move({'name': move[0], 'sourceId': move[1], 'destId': move[2], 'numSoldiers': move[3]})
+        moves = list(moves)
+        for action in chain:
+            source, destination = action.split('_')
+            moved = game.countries[source]['soldiers'] - game.countries[destination]['soldiers'] - 1
+            if not game.apply_move({'name': 'attack', 'sourceId': source, 'destId': destination, 'numSoldiers': moved}):
+                break
+            moves.append(("attack", source, destination, moved))
+        return moves
+
+    # the best chain of attacks from the board the shared state is at, as (eval, actions)
+    def best_chain(self, depth):
+        best = (self.problem.eval(self.state), [])
+        if depth <= 0 or self.plan_out_of_time():
+            return best
+        for action in self.problem.turn_actions(self.state)[:PLAN_BRANCHING]:
+            self.problem.apply_turn_action(self.state, action)
+            self.nodes_expanded += 1
+            value, chain = self.best_chain(depth - 1)
+            self.state.undo()
+            if value > best[0]:
+                best = (value, [action] + chain)
+        return best
+
+    def plan_out_of_time(self):
+        if self.cancel is not None and self.cancel.is_set():
+            return True
+        return self.plan_deadline is not None and time.time() > self.plan_deadline
+
     def back_track(self, node):
         steps = list()
         attack = []
@@ -424,15 +1243,36 @@ class Agent:
             attack.append(string)
         return attack
 
-def ai_reinforce(state, unassigned_units):
+def memory_limit_mb(data):
+    limit = data.get('memory_limit_mb', MEMORY_LIMIT_MB)
+    return float(limit) if limit is not None else None
+
+# (frontier cap, size of the table of expanded boards) of an informed search within the
+# request's memory limit. Without a limit the frontier is unbounded and the table has
+# its default size.
+def search_limits(data):
+    limit = memory_limit_mb(data)
+    if limit is None:
+        return None, TABLE_SIZE
+    budget = limit * 1024 * 1024
+    # the table's size is a power of two, with slots and entries within its share
+    expanded_size = 1024
+    while expanded_size * 2 * (8 + ENTRY_BYTES) <= budget * EXPANDED_SHARE and expanded_size < TABLE_SIZE:
+        expanded_size *= 2
+    frontier_cap = max(int(budget * (1 - EXPANDED_SHARE) / FRONTIER_NODE_BYTES), 16)
+    return frontier_cap, expanded_size
+
+# city_bsr, the BSR of the current player's border cities, is computed here unless it
+# is given, as /solve_batch does for many boards at once (see batch.py)
+def ai_reinforce(state, unassigned_units, city_bsr=None):
     function = Functions()
-    search_cities = state.dict_player_cities[state.current_player]
-    city_bsr = {}
-    for city in search_cities:
-        try:
-            city_bsr[city] = function.BSR(state, city, state.opponent_adj_list[city])
-        except:
-            continue
+    if city_bsr is None:
+        city_bsr = {}
+        for city in state.get_border_list(state.current_player):
+            try:
+                city_bsr[city] = function.BSR(state, city, state.opponent_adj_list[city])
+            except:
+                continue
     city_NBSR = function.NBSR(city_bsr)
     sorted_NBSR = sorted(city_NBSR.items(), key=operator.itemgetter(1), reverse=True)
     moves = []
@@ -442,21 +1282,25 @@ def ai_reinforce(state, unassigned_units):
         val = ceil(tup[1] * unassigned_units)
         if val != 0:
             unassigned_units -= val
-            state.dict_city_troops[tup[0]] += val
+            state.set_troops(tup[0], state.dict_city_troops[tup[0]] + val)
             moves.append(("reinforce", tup[0] , 0, val))
     return moves
 
 
 class Functions:
+    def __init__(self):
+        self.heuristic_calls = 0
+
+    # BSR and NBSR of the opponent cities bordering the current player,
+    # computed once per board
     def heuristic(self, state):
-        search_cities = state.dict_player_cities[state.current_player]
+        return state.cached('heuristic', lambda: self.compute_heuristic(state))
+
+    def compute_heuristic(self, state):
+        self.heuristic_calls += 1
         opponent_BSR = {}
-        for city in search_cities:
-            try:
-                opponents = state.opponent_adj_list[city]
-            except:
-                continue
-            for opponent in opponents:
+        for city in state.get_border_list(state.current_player):
+            for opponent in state.opponent_adj_list[city]:
                 if opponent not in opponent_BSR:
                     opponent_BSR[opponent] = self.BSR(state, opponent, state.opponent_adj_list[opponent])
         opponent_NBSR = self.NBSR(opponent_BSR)
@@ -489,9 +1333,8 @@ class Functions:
 
     def total_BSR(self, state):
         total = 0
-        for city in state.dict_player_cities[state.current_player]:
-            if city in state.opponent_adj_list:
-                total += self.BSR(state, city, state.opponent_adj_list[city])
+        for city in state.get_border_list(state.current_player):
+            total += self.BSR(state, city, state.opponent_adj_list[city])
         return total
 
 
@@ -519,51 +1362,101 @@ class Functions:
 
 
 class Problem:
-    def __init__(self):
+    def __init__(self, evaluator=None):
         self.function = Functions()
-
-
-    def next_state(self, current_state, action):
-        attacks = action.split('_')
-        attack = []
-        for string in attacks:
-            attack.append(string)
-        next_state = deepcopy(current_state)
-        cost = next_state.dict_city_troops[attack[1]] # troops that will die
-        next_state.dict_city_troops[attack[0]] -= next_state.dict_city_troops[attack[1]]
-        next_state.dict_city_troops[attack[1]] = 0
-
-        owner = next_state.get_player_of_city(attack[1])
-        # append to the new player
-        next_state.dict_player_cities[next_state.current_player].append(attack[1])
-        # remove from the old player
-        next_state.dict_player_cities[owner].remove(attack[1])
-        # invert opponent
-        next_state.opponent_adj_list = next_state.get_opponent_neighbours()
+        # learned leaf evaluator of value_model.py, None for compute_eval
+        self.evaluator = evaluator
+
+
+    # applies an action to the state in place, it is reverted by state.undo().
+    # survivors are the attacker's troops after the capture, by default
+    # it loses as many troops as the defender had
+    def apply_action(self, state, action, survivors=None):
+        attack = action.split('_')
+        # opponents of both cities before the attack
+        opponents1 = state.opponent_adj_list.get(attack[0])
+        opponents2 = state.opponent_adj_list.get(attack[1])
+        cost = state.apply_attack(attack[0], attack[1]) # troops that died
+        if survivors is not None:
+            state.set_troops(attack[0], survivors)
         # redistribute troops
-        try:
-            bsr1 = self.function.BSR_(next_state, attack[0], current_state.opponent_adj_list[attack[0]], 1)
-        except:
-            bsr1 = 0
-        try:
-            bsr2 = self.function.BSR_(next_state, attack[1], current_state.opponent_adj_list[attack[1]], 1)
-        except:
-            bsr2 = 0
+        bsr1 = self.function.BSR_(state, attack[0], opponents1, 1) if opponents1 else 0
+        bsr2 = self.function.BSR_(state, attack[1], opponents2, 1) if opponents2 else 0
         if bsr1 == 0 and bsr2 == 0:
             nbsr1 = 0.5 # nbsr2 = 0.5
         else:
             nbsr1 = bsr1 / (bsr1 + bsr2)    # nbsr2 = bsr2 / (bsr1 + bsr2)
 
-        val = next_state.dict_city_troops[attack[0]]
+        val = state.dict_city_troops[attack[0]]
         val1 = floor(val * nbsr1) if floor(val * nbsr1) >= 1 else 1
         if val > val1:
-            next_state.dict_city_troops[attack[0]] = val1
+            state.set_troops(attack[0], val1)
         else: # val = val1
-            next_state.dict_city_troops[attack[0]] = val1 - 1
-        next_state.dict_city_troops[attack[1]] = val - next_state.dict_city_troops[attack[0]]
-        next_state.unassigned_units = max(len(next_state.dict_player_cities[next_state.current_player]) // 3, 3)
-        ai_reinforce(next_state, next_state.unassigned_units)
-        return next_state, cost
+            state.set_troops(attack[0], val1 - 1)
+        state.set_troops(attack[1], val - state.dict_city_troops[attack[0]])
+        self.reinforce(state)
+        return cost
+
+    # the reinforcement of the next turn that follows every action
+    def reinforce(self, state):
+        state.unassigned_units = max(len(state.dict_player_cities[state.current_player]) // 3, 3)
+        ai_reinforce(state, state.unassigned_units)
+
+    # the outcomes of an attack under the dice model of combat.py, as [(probability, outcome)]
+    # where an outcome is (won, attacker troops left, defender troops left) rounded to whole troops
+    def attack_outcomes(self, state, action):
+        source, destination = action.split('_')
+        win, _, _, survivors, defenders_left = combat.outcome(state.dict_city_troops[source], state.dict_city_troops[destination])
+        outcomes = []
+        if win > 0:
+            outcomes.append((win, (True, max(int(round(survivors)), 2), 0)))
+        if win < 1:
+            outcomes.append((1 - win, (False, 1, max(int(round(defenders_left)), 1))))
+        return outcomes
+
+    # applies an outcome of attack_outcomes in place, reverted by state.undo()
+    def apply_outcome(self, state, action, outcome):
+        won, attacker_left, defender_left = outcome
+        if won:
+            return self.apply_action(state, action, survivors=attacker_left)
+        source, destination = action.split('_')
+        cost = state.dict_city_troops[destination] - defender_left
+        state.apply_repulse(source, destination, attacker_left, defender_left)
+        self.reinforce(state)
+        return cost
+
+    # applies an attack in place the way Game.js plays it within a turn: the attacker
+    # keeps one soldier and moves the other survivors into the captured city, and no
+    # reinforcements follow. Reverted by state.undo()
+    def apply_turn_action(self, state, action):
+        attack = action.split('_')
+        moved = state.dict_city_troops[attack[0]] - state.dict_city_troops[attack[1]] - 1
+        cost = state.apply_attack(attack[0], attack[1])
+        state.set_troops(attack[0], 1)
+        state.set_troops(attack[1], moved)
+        return cost
+
+    # whether Game.js accepts the attack on the state's board
+    def can_attack(self, state, action):
+        source, destination = action.split('_')
+        return (state.get_player_of_city(source) == state.current_player
+                and state.get_player_of_city(destination) != state.current_player
+                and destination in state.adj_list.get(source, ())
+                and state.dict_city_troops[source] - state.dict_city_troops[destination] >= 2)
+
+    # the actions of get_actions, the ones on the most outnumbered targets first
+    def turn_actions(self, state):
+        BSR, _ = self.function.heuristic(state)
+        return sorted(self.get_actions(state), key=lambda action: -BSR[action.split('_')[1]])
+
+    # actions leading from the root of the search to the given node
+    def path(self, node):
+        actions = []
+        while node.parent != None:
+            actions.append(node.action)
+            node = node.parent
+        actions.reverse()
+        return actions
 
     def goal_test(self, state):
         for player in state.dict_player_cities:
@@ -571,7 +1464,11 @@ class Problem:
                 return False
         return True
 
+    # a fresh list every call, the actions themselves are computed once per board
     def get_actions(self, state):
+        return list(state.cached('actions', lambda: self.compute_actions(state)))
+
+    def compute_actions(self, state):
         BSR, NBSR = self.function.heuristic(state)
         attacks = self.function.threshold(state, BSR, NBSR)
         actions = []
@@ -580,11 +1477,18 @@ class Problem:
             actions.append(action)
         return actions
 
-    def child_node(self, node, action):
-        next_state, cost = self.next_state(node.state, action)
-        return Node(next_state, node, action, node.path_cost + cost, node.depth + 1)
+    # applies the action to the shared search state instead of copying it,
+    # the returned node has no state of its own
+    def apply_child(self, node, action, state):
+        cost = self.apply_action(state, action)
+        return Node(None, node, action, node.path_cost + cost, node.depth + 1)
 
     def eval(self, state):
+      if self.evaluator is not None:
+        return state.cached('eval', lambda: self.evaluator.evaluate(state))
+      return state.cached('eval', lambda: self.compute_eval(state))
+
+    def compute_eval(self, state):
       my_soldiers_count = sum(state.get_troops_of_cities(state.dict_player_cities[state.current_player]))
       opponent_soldiers_count = sum(state.get_troops_of_cities(state.get_opponent_cities()))
 
@@ -1,26 +1,95 @@
-from flask import Flask, render_template, send_from_directory, request, jsonify
+from flask import Flask, render_template, send_from_directory, request, jsonify, Response
 from agent import Agent
+from topology import registry, UnknownMap
+from service import SolveService
+from sessions import sessions
+from instrumentation import registry as metrics
+import wire
+import batch
+from capture import capture
+import os
 import json
+import logging
 import time
 import math
 from flask_cors import CORS, cross_origin
 
 app = Flask(__name__)
 CORS(app)
+# traces of sampled requests are logged at INFO, the per-request lines at DEBUG
+logging.basicConfig(level=os.environ.get('RISK_LOG_LEVEL', 'INFO'))
+logger = logging.getLogger('risk')
+
+# with RISK_ASYNC=1 the searches run on the service's worker threads instead of the request's thread
+service = SolveService() if os.environ.get('RISK_ASYNC') else None
 
 @app.route('/solve', methods=['POST'])
 @cross_origin("*")
 def solve():
-    data = request.get_json()
-    print(data["G"])
-    print(data["ctx"])
-    print(data["agent"])
-    print(data["adjacencyList"])
-    solution = Agent(data).target_list
-    print(solution)
-    # print(jsonify(solution))
+    # boards in the binary format of wire.py are answered in that format as well
+    binary = request.mimetype == wire.CONTENT_TYPE
+    try:
+        data = wire.decode_request(request.get_data()) if binary else request.get_json()
+        logger.debug('solve agent=%s phase=%s player=%s', data["agent"], data["ctx"]["phase"], data["ctx"]["currentPlayer"])
+        # with RISK_CAPTURE_DIR the payload is kept for replay.py, see capture.py
+        captured = capture.begin(data)
+        status = 500
+        try:
+            if service is not None:
+                status, solution = service.solve(data)
+                if status != 200:
+                    return jsonify(solution), status
+            else:
+                solution = Agent(data).target_list
+                status = 200
+        finally:
+            capture.end(captured, status)
+    except UnknownMap as e:
+        # the map was evicted from the registry or never sent, the client resends the adjacencyList
+        return jsonify({"error": "unknown map_id", "map_id": e.args[0]}), 404
+    except wire.UnknownBase as e:
+        # a delta against a board the server dropped, the client resends the full board
+        return jsonify({"error": "unknown base board", "game_id": e.args[0]}), 412
+    except wire.WireError as e:
+        return jsonify({"error": str(e)}), 400
+    if binary:
+        return Response(wire.encode_response(solution), mimetype=wire.RESPONSE_CONTENT_TYPE)
     return jsonify(solution)
 
 
+# many /solve boards in one request, see batch.py
+@app.route('/solve_batch', methods=['POST'])
+@cross_origin("*")
+def solve_batch():
+    return jsonify({"results": batch.solve_batch(request.get_json())})
+
+
+# queue depth and worker usage of the async service, and the game sessions kept
+@app.route('/status', methods=['GET'])
+@cross_origin("*")
+def status():
+    if service is None:
+        return jsonify({"async": False, "sessions": sessions.status()})
+    return jsonify(dict(service.status(), **{"async": True, "sessions": sessions.status()}))
+
+
+# per-agent totals of the request counters and phase timings, see instrumentation.py
+@app.route('/metrics', methods=['GET'])
+@cross_origin("*")
+def get_metrics():
+    if request.args.get('format') == 'prometheus':
+        return Response(metrics.prometheus(), mimetype='text/plain')
+    return jsonify(metrics.snapshot())
+
+
+# registers a map ahead of the game, /solve requests can then send its map_id
+@app.route('/maps', methods=['POST'])
+@cross_origin("*")
+def register_map():
+    data = request.get_json()
+    topology = registry.register(data["adjacencyList"])
+    return jsonify({"map_id": topology.map_id, "countries": topology.size})
+
+
 if __name__ == '__main__':
   app.run(debug=True)
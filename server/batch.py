@@ -0,0 +1,111 @@
+import os
+import json
+import numpy as np
+import bsr
+import parallel
+from agent import Agent
+from compact import CompactState
+from topology import registry, topology_of, UnknownMap
+from instrumentation import registry as metrics
+
+# answers many /solve boards in one request, e.g. for a farm of simulated games.
+# The boards are grouped by map, the root BSR of the War boards of a map is computed
+# in one vectorized pass over all of them, and their searches are dealt out over the
+# process pool of parallel.py, a map's topology being built once per worker.
+
+# worker processes of a batch when the request does not ask for a number
+BATCH_WORKERS = int(os.environ.get('RISK_BATCH_WORKERS', os.cpu_count() or 1))
+# agents that start their War turn with reinforce_root and then search
+SEARCH_AGENTS = ('greedy', 'A_star', 'A_star_realtime', 'minimax', 'mcts', 'expectiminimax')
+# request fields every board gets unless it has its own
+SHARED = ('adjacencyList', 'map_id', 'time_budget_ms', 'plan_turn', 'max_attacks', 'memory_limit_mb', 'playouts', 'evaluator')
+
+
+# BSR of the current player's border cities of every board, as ai_reinforce computes
+# them, from one pass of bsr.bsr over the boards of a map
+def root_bsr(topology, boards):
+    compacts = [CompactState(data, topology) for data in boards]
+    owner = np.stack([compact.owner for compact in compacts])
+    troops = np.stack([compact.troops for compact in compacts])
+    values, is_border = bsr.bsr(topology, owner, troops)
+    index = topology.index
+    result = []
+    for row, data in enumerate(boards):
+        player = str(data['ctx']['currentPlayer'])
+        countries = data['G']['countries']
+        # in the order of the payload's countries like State.dict_player_cities,
+        # cities without troops have no BSR (ai_reinforce skips their ZeroDivisionError)
+        city_bsr = {}
+        for city_id in countries:
+            idx = index[str(city_id)]
+            if countries[city_id]['owner'] == player and is_border[row, idx] and troops[row, idx] != 0:
+                city_bsr[city_id] = float(values[row, idx])
+        result.append(city_bsr)
+    return result
+
+
+# the result of a board is {"ok": true, "result": the /solve response} or
+# {"ok": false, "error", "status"}, with the "map_id" of an unknown map
+def solve_board(data, city_bsr=None):
+    try:
+        agent = Agent(data, root_bsr=city_bsr)
+        return {"ok": True, "result": json.loads(agent.target_list)}, agent.metrics
+    except UnknownMap as e:
+        return unknown_map(e), None
+    except Exception as e:
+        return {"ok": False, "error": '%s: %s' % (type(e).__name__, e), "status": 500}, None
+
+
+def unknown_map(e):
+    return {"ok": False, "error": "unknown map_id", "map_id": e.args[0], "status": 404}
+
+
+# runs in a worker: the boards of one map, [(position, board, city_bsr)]
+def _solve_chunk(adj_list, boards):
+    topology = registry.register(adj_list)
+    results = []
+    for position, data, city_bsr in boards:
+        data.pop('adjacencyList', None)
+        data['map_id'] = topology.map_id
+        results.append((position, solve_board(data, city_bsr)))
+    return results
+
+
+# the /solve_batch request {"boards": [payload, ...]} with optional fields shared by
+# all boards (SHARED) and "workers". Returns the result of every board (see solve_board), in order.
+def solve_batch(request):
+    workers = min(max(int(request.get('workers', BATCH_WORKERS)), 1), parallel.POOL_SIZE)
+    boards = [dict({key: request[key] for key in SHARED if key in request}, **board) for board in request['boards']]
+    results = [None] * len(boards)
+    groups = {}
+    for position, data in enumerate(boards):
+        # a batch is already spread over the pool, its boards search in a single process
+        data['workers'] = 1
+        try:
+            topology = topology_of(data)
+        except UnknownMap as e:
+            results[position] = unknown_map(e)
+            continue
+        if data['ctx']['phase'] == 'War' and data['agent'] in SEARCH_AGENTS:
+            groups.setdefault(topology.map_id, (topology, []))[1].append(position)
+        else:
+            # occupation, reinforcement and the fast agents take less than a trip to a worker
+            results[position], _ = solve_board(data)
+
+    futures = []
+    for topology, positions in groups.values():
+        work = list(zip(positions, [boards[position] for position in positions],
+                        root_bsr(topology, [boards[position] for position in positions])))
+        if workers == 1:
+            for position, data, city_bsr in work:
+                results[position], _ = solve_board(data, city_bsr)
+            continue
+        # boards are dealt out round-robin, so that every worker gets a share of every map
+        futures += parallel.submit(_solve_chunk, [(topology.adj_list, share) for share in parallel.split(work, workers)])
+    for future in futures:
+        for position, (result, request_metrics) in future.result():
+            results[position] = result
+            # the counters of a board searched in a worker are only known to this process now
+            if request_metrics is not None:
+                metrics.record(request_metrics)
+    return results
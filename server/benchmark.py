@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+from collections import deque
+import numpy as np
+from maps import MAP_FILES, load_map
+from heap import Heap
+from agent import Agent, State, Problem, Functions
+
+# times the agents end to end and the hot functions of the search on
+# reproducible boards, e.g.
+#   python benchmark.py --out before.json
+#   python benchmark.py --out after.json --compare before.json
+
+# share of the map owned by player 0 and troops per country at each stage of a game
+STAGES = {
+    'early': dict(share=0.5, troops=(1, 3), units=3, regions=8),
+    'mid': dict(share=0.5, troops=(2, 8), units=7, regions=3),
+    'late': dict(share=0.8, troops=(3, 12), units=12, regions=1)
+}
+
+
+# a board of the given stage: both players own contiguous regions grown
+# from random seed countries, the same seed always gives the same board
+def fixture(map_name, stage, seed=0):
+    settings = STAGES[stage]
+    rnd = random.Random('%s/%s/%d' % (map_name, stage, seed))
+    adj = load_map(map_name)['adjacencyList']
+    cities = sorted(adj, key=int)
+    wanted = int(round(len(cities) * settings['share']))
+    owner = {}
+    # player 0 grows breadth first from its seed countries, player 1 gets the rest
+    queue = deque(rnd.sample(cities, settings['regions']))
+    while len(owner) < wanted:
+        if not queue:
+            queue.append(rnd.choice([city for city in cities if city not in owner]))
+        city = queue.popleft()
+        if city in owner:
+            continue
+        owner[city] = '0'
+        neighbours = [str(x) for x in adj[city]]
+        rnd.shuffle(neighbours)
+        queue.extend(neighbours)
+    countries = {city: {'owner': owner.get(city, '1'), 'soldiers': rnd.randint(*settings['troops'])}
+                 for city in cities}
+    return {'G': {'countries': countries, 'unassignedUnits': {'0': settings['units'], '1': settings['units']}},
+            'ctx': {'currentPlayer': '0', 'phase': 'War'}, 'agent': None,
+            'adjacencyList': {city: list(adj[city]) for city in adj}}
+
+
+def fresh(data, **options):
+    data = json.loads(json.dumps(data))
+    data.update(options)
+    return data
+
+
+def summary(latencies, nodes=None):
+    latencies = np.array(latencies)
+    result = {'calls': len(latencies), 'mean_ms': latencies.mean() * 1000}
+    result.update(zip(('p50_ms', 'p95_ms', 'p99_ms'), np.percentile(latencies * 1000, [50, 95, 99]).tolist()))
+    if nodes is not None:
+        result['nodes'] = int(np.sum(nodes))
+        result['nodes_per_sec'] = float(np.sum(nodes) / latencies.sum()) if latencies.sum() else None
+    return result
+
+
+def peak_memory(run):
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_agent(data):
+    agent = Agent(data, solve=False)
+    agent.agents[data['agent']]()
+    return agent
+
+
+def bench_agent(data, name, repeat, options):
+    latencies, nodes = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        agent = run_agent(fresh(data, agent=name, **options))
+        latencies.append(time.perf_counter() - start)
+        nodes.append(agent.nodes_expanded)
+    result = summary(latencies, nodes)
+    result['peak_bytes'] = peak_memory(lambda: run_agent(fresh(data, agent=name, **options)))
+    return result
+
+
+# calls fn(*args) repeatedly, with setup() building fresh arguments outside of the timing
+def bench_function(setup, fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - start)
+    result = summary(latencies)
+    args = setup()
+    result['peak_bytes'] = peak_memory(lambda: fn(*args))
+    return result
+
+
+def heap_workload(items):
+    heap = Heap()
+    for key, priority in enumerate(items):
+        heap.add(key, priority=priority, key=key)
+    for key in range(0, len(items), 4):
+        if heap.contains(key):
+            heap.decrease_key(key, heap.priority(key) - 1)
+    while len(heap):
+        heap.pop()
+
+
+def bench_functions(data, repeat):
+    problem, function = Problem(), Functions()
+    state = State(fresh(data, agent='minimax'))
+    actions = problem.get_actions(state)
+
+    # the state keeps what was computed on its board, every call
+    # starts from an empty cache so that it is timed computing it
+    def uncached():
+        state.board_cache = {}
+        return (state,)
+    results = {
+        'State': bench_function(lambda: (fresh(data, agent='minimax'),), State, repeat),
+        'Functions.total_BSR': bench_function(uncached, function.total_BSR, repeat),
+        'Functions.heuristic': bench_function(uncached, function.heuristic, repeat),
+        'Problem.get_actions': bench_function(uncached, problem.get_actions, repeat)
+    }
+    if actions:
+        # a child of the search, applied to the shared state and taken back
+        apply_and_undo = lambda state, action: (problem.apply_action(state, action), state.undo())
+        results['Problem.apply_action+undo'] = bench_function(lambda: (state, actions[0]), apply_and_undo, repeat)
+    rnd = random.Random(0)
+    items = [rnd.random() for _ in range(10000)]
+    results['Heap (10k add/decrease/pop)'] = bench_function(lambda: (items,), heap_workload, max(repeat // 10, 1))
+    return results
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run(maps, stages, agents, repeat, options, log=sys.stderr):
+    results = {}
+    for map_name in maps:
+        for stage in stages:
+            data = fixture(map_name, stage)
+            for name in agents:
+                key = 'agent/%s/%s/%s' % (name, map_name, stage)
+                print(key, file=log)
+                results[key] = bench_agent(data, name, repeat, options)
+            for name, result in bench_functions(data, repeat * 10).items():
+                results['function/%s/%s/%s' % (name, map_name, stage)] = result
+    return results
+
+
+# p50 latency of this run relative to a previous one, for the keys both have
+def compare(results, baseline):
+    print('%-55s %12s %12s %8s' % ('benchmark', 'before ms', 'after ms', 'ratio'))
+    for key in sorted(set(results) & set(baseline)):
+        before, after = baseline[key]['p50_ms'], results[key]['p50_ms']
+        print('%-55s %12.3f %12.3f %8.2f' % (key, before, after, after / before if before else float('nan')))
+
+
+def print_results(results):
+    print('%-55s %10s %10s %10s %12s %10s' % ('benchmark', 'p50 ms', 'p95 ms', 'p99 ms', 'nodes/sec', 'peak KiB'))
+    for key, result in results.items():
+        nodes = result.get('nodes_per_sec')
+        print('%-55s %10.3f %10.3f %10.3f %12s %10.1f' % (
+            key, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            '-' if not nodes else '%.0f' % nodes, result['peak_bytes'] / 1024))
+
+
+def main(argv=None):
+    agent_names = list(Agent(fixture('USA', 'early'), solve=False).agents)
+    parser = argparse.ArgumentParser(description='Latency, nodes/sec and memory of the agents and the search functions')
+    parser.add_argument('--maps', nargs='+', default=sorted(MAP_FILES), choices=sorted(MAP_FILES))
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--agents', nargs='+', default=agent_names, choices=agent_names)
+    parser.add_argument('--repeat', type=int, default=5, help='calls per agent and board, functions get ten times more')
+    parser.add_argument('--time-budget-ms', type=float, default=1000,
+                        help='time_budget_ms of every agent request, so that the A* agents terminate')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare the p50 latencies with')
+    args = parser.parse_args(argv)
+
+    options = {'workers': 1, 'time_budget_ms': args.time_budget_ms}
+    results = run(args.maps, args.stages, args.agents, args.repeat, options)
+    print_results(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'environment': environment(), 'options': vars(args), 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
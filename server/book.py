@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import itertools
+import struct
+import hashlib
+import argparse
+import threading
+import multiprocessing
+import numpy as np
+import engine
+from maps import MAP_FILES
+from topology import topology_of
+
+# opening books: the placement to play on the boards of the Occupation and the
+# Reinforce Countries phases, learnt offline by self-play (python book.py --map World)
+# and looked up by the agents before they fall back to occupy and ai_reinforce.
+#
+# A book is one file per map, <map_id>.book, with integers little endian:
+#   header   4s magic, u8 version, 3 pad bytes, u32 count, 32s map_id, 4 pad bytes
+#   keys     u64 position keys (see position_key), sorted
+#   cities   u16 city of every key, by its position in topology.sorted_ids
+# The server maps the files into memory the first time a board of their map is asked about.
+
+MAGIC = b'RBK1'
+VERSION = 1
+HEADER = struct.Struct('<4sBxxxI32sxxxx')
+OPENING_PHASES = (engine.OCCUPATION, engine.REINFORCE)
+# where the server looks for books and the builder writes them
+BOOK_DIR = os.environ.get('RISK_BOOK_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'books'))
+
+
+# a file that is not a book of the expected map
+class BookError(ValueError):
+    pass
+
+
+# 64-bit key of the phase and player to move, xor-ed into the board's Zobrist hash
+def turn_key(phase, player):
+    return int.from_bytes(hashlib.blake2b(repr((phase, str(player))).encode(), digest_size=8).digest(), 'little')
+
+
+# the key of the board of a State in the books
+def position_key(state):
+    return state.hash ^ turn_key(state.phase, state.current_player)
+
+
+class Book:
+    def __init__(self, path, map_id):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise BookError('%s: truncated' % path)
+        magic, version, count, book_map = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise BookError('%s: not a version %d book' % (path, VERSION))
+        if book_map.rstrip(b'\0').decode() != map_id:
+            raise BookError('%s: book of another map' % path)
+        self.path = path
+        self.count = count
+        if count:
+            self.keys = np.memmap(path, dtype='<u8', mode='r', offset=HEADER.size, shape=(count,))
+            self.cities = np.memmap(path, dtype='<u2', mode='r', offset=HEADER.size + 8 * count, shape=(count,))
+
+    def __len__(self):
+        return self.count
+
+    # position in sorted_ids of the book's city for the key, None on a miss
+    def get(self, key):
+        if not self.count:
+            return None
+        key = np.uint64(key)
+        idx = int(np.searchsorted(self.keys, key))
+        if idx < self.count and self.keys[idx] == key:
+            return int(self.cities[idx])
+        return None
+
+
+# the books of the maps, opened on first use. A map without a book is remembered
+# as such, so that its boards are not looked up on disk again
+class BookShelf:
+    def __init__(self, directory=BOOK_DIR):
+        self.directory = directory
+        self.books = {}
+        self.lock = threading.Lock()
+
+    def get(self, map_id):
+        if map_id not in self.books:
+            with self.lock:
+                if map_id not in self.books:
+                    path = os.path.join(self.directory, '%s.book' % map_id)
+                    self.books[map_id] = Book(path, map_id) if os.path.exists(path) else None
+        return self.books[map_id]
+
+
+books = BookShelf()
+
+
+# the city the book plays on the state's board, None when there is no book of
+# the map or the board is not in it. A city the rules don't allow there is a
+# miss too, so that a hash collision can't make an agent play an invalid move
+def lookup(state, shelf=books):
+    if state.phase not in OPENING_PHASES:
+        return None
+    book = shelf.get(state.topology.map_id)
+    if book is None:
+        return None
+    idx = book.get(position_key(state))
+    if idx is None or idx >= state.topology.size:
+        return None
+    city_id = state.topology.sorted_ids[idx]
+    if city_id not in state.dict_city_troops:
+        return None
+    owner = state.get_player_of_city(city_id)
+    if owner != (None if state.phase == engine.OCCUPATION else state.current_player):
+        return None
+    return city_id
+
+
+def write(path, map_id, entries):
+    keys = np.array(sorted(entries), dtype='<u8')
+    cities = np.array([entries[key] for key in keys.tolist()], dtype='<u2')
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(keys), map_id.encode()))
+        f.write(keys.tobytes())
+        f.write(cities.tobytes())
+
+
+# building a book. Starting from the empty board, the builder tries a few
+# placements on every board of the opening, plays self-play games from each of
+# them and keeps the one that won most. Ties go to the placement the agent plays
+# without a book. It then goes on from the boards the best few placements lead
+# to, so that the book still answers when a player (an opponent without the
+# book, or a human) places elsewhere. The boards are taken most likely first:
+# the book's own placement passes on the weight of its board, the others pass
+# it on scaled by the deviation and by how well they did against the best.
+
+def solver(agent, options):
+    from agent import Agent
+
+    def solve(data):
+        data.update(options)
+        return Agent(data).target_list
+    return solve
+
+
+# the placement the agent plays without a book, followed by other candidates:
+# for Occupation the free cities bordering most of the player's own, for
+# Reinforce Countries the next cities of ai_reinforce's ranking
+def candidates(game, agent, count):
+    from agent import Agent, Functions
+    data = game.payload(agent)
+    data['book'] = False
+    state = Agent(data, solve=False).state
+    default = json.loads(Agent(data).target_list)['moves'][0]['sourceId']
+    if game.phase == engine.OCCUPATION:
+        free = state.dict_player_cities.get(None, [])
+        own = lambda city_id: sum(1 for x in state.adj_list.get(city_id, []) if state.get_player_of_city(x) == state.current_player)
+        ranked = sorted(free, key=own, reverse=True)
+    else:
+        function = Functions()
+        city_bsr = {}
+        for city_id in state.get_border_list(state.current_player):
+            city_bsr[city_id] = function.BSR(state, city_id, state.opponent_adj_list[city_id])
+        ranked = sorted(city_bsr, key=city_bsr.get, reverse=True) + state.dict_player_cities[state.current_player]
+    return list(dict.fromkeys([default] + ranked))[:count]
+
+
+def place(game, city_id):
+    move = 'occupy' if game.phase == engine.OCCUPATION else 'reinforce'
+    game.play_response(json.dumps({'moves': [{'name': move, 'sourceId': city_id, 'destId': 0, 'numSoldiers': 1}]}))
+
+
+# runs in a worker process: plays a self-play game on from the candidate placement,
+# 1 when the player who made it wins and 0.5 for a draw
+def playout(args):
+    game, city_id, seed, settings = args
+    player = game.current_player
+    place(game, city_id)
+    rng = random.Random(seed)
+    solve = solver(settings['agent'], dict(settings['options'], book=False))
+
+    def noisy(data):
+        # the rest of the opening is played with some random placements,
+        # so that the games from one candidate are not all the same
+        if data['ctx']['phase'] in OPENING_PHASES and rng.random() < settings['noise']:
+            if data['ctx']['phase'] == engine.OCCUPATION:
+                cities = [c for c in data['G']['countries'] if data['G']['countries'][c]['owner'] is None]
+            else:
+                cities = [c for c in data['G']['countries'] if data['G']['countries'][c]['owner'] == data['ctx']['currentPlayer']]
+            move = 'occupy' if data['ctx']['phase'] == engine.OCCUPATION else 'reinforce'
+            return json.dumps({'moves': [{'name': move, 'sourceId': rng.choice(cities), 'destId': 0, 'numSoldiers': 1}]})
+        return solve(data)
+    winner = engine.play(game, [settings['agent']] * game.num_players, noisy, settings['max_turns'])
+    return 0.5 if winner is None else float(winner == player)
+
+
+# a copy of the game to play a self-play game on
+def clone(game):
+    copy = engine.Game(game.map_name, game.num_players, game_id=game.game_id, game_map=game.game_map)
+    copy.countries = json.loads(json.dumps(game.countries))
+    copy.unassigned_units = dict(game.unassigned_units)
+    copy.phases = list(game.phases)
+    copy.phase, copy.current_player, copy.turn = game.phase, game.current_player, game.turn
+    return copy
+
+
+def build(map_name, agent, games, count, noise, max_turns, options, processes,
+          branches=2, positions=200, deviation=0.5, seed=0, log=print):
+    from agent import Agent
+    game = engine.Game(map_name, seed=seed, game_id='book')
+    settings = dict(agent=agent, noise=noise, max_turns=max_turns, options=options)
+    entries = {}
+    # boards to put in the book as (-weight, ply, order, game), order breaks the ties
+    order = itertools.count()
+    queue = [(-1.0, 0, next(order), game)]
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        while queue and len(entries) < positions:
+            weight, ply, _, game = heapq.heappop(queue)
+            if game.phase not in OPENING_PHASES or game.is_over():
+                continue
+            data = game.payload(agent)
+            state = Agent(data, solve=False).state
+            key = position_key(state)
+            # a board reached again by other placements
+            if key in entries:
+                continue
+            start = time.perf_counter()
+            cities = candidates(game, agent, count)
+            jobs = [(clone(game), city_id, seed * 100003 + ply * 1009 + g, settings)
+                    for city_id in cities for g in range(games)]
+            scores = (pool.map(playout, jobs) if pool is not None else [playout(job) for job in jobs])
+            wins = [sum(scores[i * games:(i + 1) * games]) / games for i in range(len(cities))]
+            best = int(np.argmax(wins))
+            entries[key] = state.topology.sorted_index[cities[best]]
+            log('%s %s ply %d player %s (weight %.2f): %s (%.2f, default %s %.2f) in %.1fs' % (
+                map_name, game.phase, ply, game.current_player, -weight, cities[best], wins[best],
+                cities[0], wins[0], time.perf_counter() - start))
+            for i in sorted(range(len(cities)), key=lambda i: (i != best, -wins[i]))[:branches]:
+                child = clone(game)
+                place(child, cities[i])
+                share = 1.0 if i == best else deviation * wins[i] / wins[best] if wins[best] else 0.0
+                heapq.heappush(queue, (weight * share, ply + 1, next(order), child))
+    finally:
+        if pool is not None:
+            pool.close()
+    return topology_of(game.payload(agent)).map_id, entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Builds the opening book of a map by self-play')
+    parser.add_argument('--map', default='World', choices=sorted(MAP_FILES))
+    parser.add_argument('--agent', default='greedy', help='agent playing the self-play games, as in Agent.agents')
+    parser.add_argument('--games', type=int, default=4, help='self-play games per candidate placement')
+    parser.add_argument('--candidates', type=int, default=3, help='placements tried on every board')
+    parser.add_argument('--noise', type=float, default=0.3, help='share of random placements in the rest of the opening of a game')
+    parser.add_argument('--branches', type=int, default=2, help='best placements of every board whose boards are added too, 1 keeps only the main line')
+    parser.add_argument('--positions', type=int, default=200, help='boards in the book at most')
+    parser.add_argument('--deviation', type=float, default=0.5, help='weight of a board reached by another placement than the book\'s, relative to its parent')
+    parser.add_argument('--max-turns', type=int, default=300, help='games still running after this many turns are draws')
+    parser.add_argument('--time-budget-ms', type=float, default=50, help='time_budget_ms of the self-play requests')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=BOOK_DIR, help='directory the book is written to')
+    args = parser.parse_args(argv)
+
+    options = {'workers': 1, 'time_budget_ms': args.time_budget_ms}
+    map_id, entries = build(args.map, args.agent, args.games, args.candidates, args.noise, args.max_turns, options,
+                            args.processes, args.branches, args.positions, args.deviation, args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, '%s.book' % map_id)
+    write(path, map_id, entries)
+    print('%d boards written to %s' % (len(entries), path))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import numpy as np
+
+# Border Security Ratio over whole boards at once.
+# owner and troops are either one board (shape [cities]) or a batch
+# of boards on the same map (shape [boards, cities]).
+
+
+# per-city sum of the troops in neighbouring cities that have a different owner
+def border_troops(topology, owner, troops):
+    owner, troops = np.atleast_2d(owner), np.atleast_2d(troops)
+    boards, size = owner.shape
+    src, dst = topology.sources, topology.indices
+    border = owner[:, src] != owner[:, dst]
+    weights = np.where(border, troops[:, dst], 0)
+    # segment sum of every board's edges by source city, offsetting each board by its row
+    segments = (src + size * np.arange(boards)[:, None]).ravel()
+    sums = np.bincount(segments, weights=weights.ravel(), minlength=boards * size).reshape(boards, size)
+    counts = np.bincount(segments, weights=border.ravel(), minlength=boards * size).reshape(boards, size)
+    return sums, counts > 0
+
+
+# per-city BSR, zero for cities that have no opponent neighbours
+def bsr(topology, owner, troops):
+    sums, is_border = border_troops(topology, owner, troops)
+    troops = np.atleast_2d(troops)
+    values = np.zeros(sums.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(sums, troops, out=values, where=is_border)
+    values[is_border & (troops == 0)] = np.inf
+    return values, is_border
+
+
+# normalizes the BSR of the selected cities of every board so that they sum up to one
+def nbsr(values, selected):
+    values = np.where(selected, values, 0)
+    totals = values.sum(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(totals > 0, values / totals, 0)
+
+
+# Functions.total_BSR for every board: sum of the BSR of the player's border cities,
+# which is the sum over the player's border edges of troops[opponent] / troops[city]
+def total_bsr(topology, owner, troops, players):
+    owner, troops = np.atleast_2d(owner), np.atleast_2d(troops)
+    src, dst = topology.sources, topology.indices
+    players = np.reshape(players, (-1, 1))
+    mine = (owner[:, src] == players) & (owner[:, dst] != players)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = troops[:, dst] / troops[:, src]
+    return np.where(mine, ratios, 0).sum(axis=1)
+
+
+# scores the children of one board, each given as the list of
+# (city index, owner, troops) entries in which it differs from the parent
+def total_bsr_children(compact, changes):
+    boards = len(changes)
+    owner = np.repeat(compact.owner[None, :], boards, axis=0)
+    troops = np.repeat(compact.troops[None, :], boards, axis=0)
+    for row, changed in enumerate(changes):
+        for idx, city_owner, city_troops in changed:
+            owner[row, idx] = city_owner
+            troops[row, idx] = city_troops
+    return total_bsr(compact.topology, owner, troops, np.full(boards, compact.player))
@@ -0,0 +1,91 @@
+import os
+import glob
+import gzip
+import json
+import time
+import uuid
+import random
+import threading
+from topology import registry, topology_of, UnknownMap
+
+# opt-in capture of /solve payloads, so that a slow request can be replayed and
+# profiled offline with replay.py. With RISK_CAPTURE_DIR set, a share
+# RISK_CAPTURE_SAMPLE (0 to 1) of the requests that took at least
+# RISK_CAPTURE_MIN_MS is appended to a corpus in that directory:
+#   solve-<pid>.jsonl.gz   one gzip member per request, a JSON object with the
+#                          request's id, time, ms, status and data (the payload
+#                          with its map_id instead of the adjacencyList)
+#   maps/<map_id>.json     the adjacency list of every map, written once
+
+CAPTURE_DIR = os.environ.get('RISK_CAPTURE_DIR')
+CAPTURE_SAMPLE = float(os.environ.get('RISK_CAPTURE_SAMPLE', 1))
+CAPTURE_MIN_MS = float(os.environ.get('RISK_CAPTURE_MIN_MS', 0))
+
+
+class Corpus:
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, 'solve-%d.jsonl.gz' % os.getpid())
+        self.maps = set()
+        self.lock = threading.Lock()
+
+    def add(self, record, topology):
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        with self.lock:
+            if topology.map_id not in self.maps:
+                os.makedirs(os.path.join(self.directory, 'maps'), exist_ok=True)
+                path = os.path.join(self.directory, 'maps', '%s.json' % topology.map_id)
+                if not os.path.exists(path):
+                    with open(path, 'w') as f:
+                        json.dump(topology.adj_list, f)
+                self.maps.add(topology.map_id)
+            with gzip.open(self.path, 'ab') as f:
+                f.write(line)
+
+    # the captured requests of every process, oldest file first
+    def records(self):
+        for path in sorted(glob.glob(os.path.join(self.directory, 'solve-*.jsonl.gz'))):
+            with gzip.open(path, 'rt') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    # registers the maps of the corpus, so that its payloads can be solved
+    def load_maps(self):
+        for path in glob.glob(os.path.join(self.directory, 'maps', '*.json')):
+            with open(path) as f:
+                registry.register(json.load(f))
+
+
+class Capture:
+    def __init__(self, directory=CAPTURE_DIR, sample=CAPTURE_SAMPLE, min_ms=CAPTURE_MIN_MS):
+        self.corpus = Corpus(directory) if directory else None
+        self.sample = sample
+        self.min_ms = min_ms
+
+    # called when a request arrives, returns what end needs to write it, or None
+    # when the request is not captured. The payload is copied here, before an
+    # agent gets to it
+    def begin(self, data):
+        if self.corpus is None or random.random() >= self.sample:
+            return None
+        try:
+            topology = topology_of(data)
+        except UnknownMap:
+            return None
+        payload = {key: value for key, value in data.items() if key != 'adjacencyList'}
+        payload['map_id'] = topology.map_id
+        return time.perf_counter(), json.loads(json.dumps(payload)), topology
+
+    def end(self, started, status=200):
+        if started is None:
+            return
+        start, payload, topology = started
+        ms = (time.perf_counter() - start) * 1000
+        if ms < self.min_ms:
+            return
+        record = {'id': uuid.uuid4().hex[:12], 'time': time.time(), 'ms': round(ms, 3), 'status': status, 'data': payload}
+        self.corpus.add(record, topology)
+
+
+capture = Capture()
@@ -0,0 +1,118 @@
+import os
+from functools import lru_cache
+from itertools import product
+import numpy as np
+
+# outcomes of a battle with the dice of the board game: the attacker rolls
+# up to three dice and keeps one soldier at home, the defender rolls up to two,
+# the highest dice are compared pairwise and the defender wins ties. A battle
+# goes on until the defender is wiped out or the attacker has a single soldier
+# left. Game.js fights without dice (gameOptions.useDice is not implemented),
+# so this is the model the chance nodes of the expectiminimax agent plan with.
+
+# troop counts the tables are built for at first, they grow when a board with larger armies comes in
+TABLE_TROOPS = 64
+# troop counts of the largest tables built (about 0.3 s for 256), larger battles are scaled down to them
+MAX_TABLE_TROOPS = int(os.environ.get('RISK_COMBAT_TROOPS', 256))
+
+
+# {(attacker losses, defender losses): probability} of one roll
+@lru_cache(maxsize=None)
+def roll(attacker_dice, defender_dice):
+    outcomes = {}
+    total = 6 ** (attacker_dice + defender_dice)
+    for dice in product(range(1, 7), repeat=attacker_dice + defender_dice):
+        attack = sorted(dice[:attacker_dice], reverse=True)
+        defence = sorted(dice[attacker_dice:], reverse=True)
+        attacker_losses = sum(1 for a, d in zip(attack, defence) if a <= d)
+        defender_losses = min(attacker_dice, defender_dice) - attacker_losses
+        key = (attacker_losses, defender_losses)
+        outcomes[key] = outcomes.get(key, 0) + 1
+    return {key: count / total for key, count in outcomes.items()}
+
+
+# tables indexed by [attacker troops, defender troops] for troop counts up to size,
+# attacker troops count the soldier that stays at home:
+#   win             probability that the attacker takes the country
+#   attacker_loss   expected attackers killed
+#   defender_loss   expected defenders killed
+#   survivors       expected attacker troops at the end of a won battle
+#   defenders_left  expected defender troops at the end of a lost battle
+class Tables:
+    def __init__(self, size):
+        self.size = size
+        shape = (size + 1, size + 1)
+        win = np.zeros(shape)
+        # expected end troops of both sides, summed over the won and the lost battles
+        attacker_end_won = np.zeros(shape)
+        defender_end_lost = np.zeros(shape)
+        attacker_end = np.zeros(shape)
+        defender_end = np.zeros(shape)
+        for attacker in range(1, size + 1):
+            for defender in range(size + 1):
+                if defender == 0:
+                    win[attacker, 0] = 1
+                    attacker_end_won[attacker, 0] = attacker_end[attacker, 0] = attacker
+                    continue
+                if attacker == 1:
+                    defender_end_lost[1, defender] = defender_end[1, defender] = defender
+                    attacker_end[1, defender] = 1
+                    continue
+                # every roll leaves a battle with fewer troops, which is already in the tables
+                for (attacker_losses, defender_losses), p in roll(min(attacker - 1, 3), min(defender, 2)).items():
+                    a, d = attacker - attacker_losses, defender - defender_losses
+                    win[attacker, defender] += p * win[a, d]
+                    attacker_end_won[attacker, defender] += p * attacker_end_won[a, d]
+                    defender_end_lost[attacker, defender] += p * defender_end_lost[a, d]
+                    attacker_end[attacker, defender] += p * attacker_end[a, d]
+                    defender_end[attacker, defender] += p * defender_end[a, d]
+        attackers, defenders = np.indices(shape)
+        self.win = win
+        self.attacker_loss = attackers - attacker_end
+        self.defender_loss = defenders - defender_end
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.survivors = np.where(win > 0, attacker_end_won / win, 0)
+            self.defenders_left = np.where(win < 1, defender_end_lost / (1 - win), 0)
+
+
+@lru_cache(maxsize=None)
+def tables(size=TABLE_TROOPS):
+    return Tables(size)
+
+
+# size of the largest tables built so far, outcome only ever reads those
+_largest = 0
+
+
+# builds the tables covering battles of up to the given troop counts, at most
+# MAX_TABLE_TROOPS. Called before a search starts its clock, so that the search
+# never spends its time budget on building them
+def prepare(troops):
+    global _largest
+    size = TABLE_TROOPS
+    while size < min(troops, MAX_TABLE_TROOPS):
+        size *= 2
+    result = tables(size)
+    _largest = max(_largest, size)
+    return result
+
+
+# (win probability, expected attacker losses, expected defender losses,
+# expected attacker troops after a win, expected defender troops after a loss)
+def outcome(attacker, defender):
+    return _outcome(attacker, defender, _largest or prepare(0).size)
+
+
+# a battle larger than the tables is looked up with both armies scaled down
+# to fit them, which keeps its odds, and its troop counts are scaled back up
+@lru_cache(maxsize=1 << 16)
+def _outcome(attacker, defender, size):
+    t = tables(size)
+    scale = 1.0
+    if max(attacker, defender) > size:
+        scale = max(attacker, defender) / size
+        attacker = min(max(int(round(attacker / scale)), 1), size)
+        defender = min(max(int(round(defender / scale)), 1 if defender else 0), size)
+    return (float(t.win[attacker, defender]), float(t.attacker_loss[attacker, defender]) * scale,
+            float(t.defender_loss[attacker, defender]) * scale, float(t.survivors[attacker, defender]) * scale,
+            float(t.defenders_left[attacker, defender]) * scale)
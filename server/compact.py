@@ -0,0 +1,83 @@
+import numpy as np
+from topology import topology_of
+
+NO_OWNER = -1
+
+
+# array-backed board: one int32 owner and troop count per city,
+# indexed by the city ids interned in the map's Topology
+class CompactState:
+    def __init__(self, data, topology=None):
+        self.topology = topology if topology is not None else topology_of(data)
+        self.current_player = str(data['ctx']['currentPlayer'])
+        self.player = int(self.current_player)
+        self.agent = data['agent']
+        self.phase = data['ctx']['phase']
+        self.unassigned_units = data['G']['unassignedUnits'][self.current_player]
+        self.owner = np.full(self.topology.size, NO_OWNER, dtype=np.int32)
+        self.troops = np.zeros(self.topology.size, dtype=np.int32)
+        cities = data['G']['countries']
+        for city_id in cities:
+            idx = self.topology.index[str(city_id)]
+            self.owner[idx] = self.encode_player(cities[city_id]['owner'])
+            self.troops[idx] = cities[city_id]['soldiers']
+
+    # builds the compact board of a (possibly searched) agent State
+    @classmethod
+    def from_state(cls, state, topology=None):
+        compact = cls.__new__(cls)
+        compact.topology = topology if topology is not None else state.topology
+        compact.current_player = state.current_player
+        compact.player = int(state.current_player)
+        compact.agent = state.agent
+        compact.phase = state.phase
+        compact.unassigned_units = state.unassigned_units
+        index = compact.topology.index
+        owner = [NO_OWNER] * compact.topology.size
+        troops = [0] * compact.topology.size
+        for player_id in state.dict_player_cities:
+            code = cls.encode_player(player_id)
+            for city_id in state.dict_player_cities[player_id]:
+                owner[index[city_id]] = code
+        for city_id in state.dict_city_troops:
+            troops[index[city_id]] = state.dict_city_troops[city_id]
+        compact.owner = np.array(owner, dtype=np.int32)
+        compact.troops = np.array(troops, dtype=np.int32)
+        return compact
+
+    @staticmethod
+    def encode_player(player_id):
+        return NO_OWNER if player_id is None else int(player_id)
+
+    @staticmethod
+    def decode_player(code):
+        return None if code == NO_OWNER else str(code)
+
+    def copy(self):
+        compact = self.__class__.__new__(self.__class__)
+        compact.__dict__.update(self.__dict__)
+        compact.owner = self.owner.copy()
+        compact.troops = self.troops.copy()
+        return compact
+
+    # given a city's id, it returns its owner (player_id)
+    def get_player_of_city(self, city_id):
+        return self.decode_player(self.owner[self.topology.index[str(city_id)]])
+
+    def get_troops_of_city(self, city_id):
+        return int(self.troops[self.topology.index[str(city_id)]])
+
+    def cities_of(self, player_id):
+        return np.flatnonzero(self.owner == self.encode_player(player_id))
+
+    # True for every edge of the CSR adjacency whose ends have different owners
+    def border_mask(self):
+        return self.owner[self.topology.sources] != self.owner[self.topology.indices]
+
+    # same content as State.opponent_adj_list, keyed by city index
+    def opponent_neighbours(self, idx):
+        neighbours = self.topology.neighbours(idx)
+        return neighbours[self.owner[neighbours] != self.owner[idx]]
+
+    def nbytes(self):
+        return self.owner.nbytes + self.troops.nbytes
@@ -0,0 +1,189 @@
+import json
+import uuid
+import random
+from maps import load_map
+
+OCCUPATION = "Occupation"
+REINFORCE = "Reinforce Countries"
+WAR = "War"
+
+# allowedMoves of the phases in Game.js, by the move names of an AI response
+ALLOWED_PHASES = {
+    'occupy': (OCCUPATION,),
+    'reinforce': (REINFORCE, WAR),
+    'attack': (WAR,)
+}
+
+# units every player starts with, as set by the options page
+UNITS_PER_PLAYER = 27
+
+
+# headless copy of the game defined in client/src/Game.js: the same setup,
+# moves, phases and turn-begin units, with the moves of an AI response applied
+# the way RiskGameBoard.simulateAIMoves does it
+class Game:
+    def __init__(self, map_name='World', num_players=2, units_per_player=UNITS_PER_PLAYER,
+                 random_start=False, seed=None, game_id=None, game_map=None):
+        self.game_id = game_id if game_id is not None else uuid.uuid4().hex
+        self.map_name = map_name
+        self.game_map = game_map if game_map is not None else load_map(map_name)
+        self.num_players = num_players
+        self.rng = random.Random(seed)
+        self.countries = {city_id: {'owner': None, 'soldiers': 0} for city_id in self.game_map['countryName']}
+        self.unassigned_units = {str(player): units_per_player for player in range(num_players)}
+        self.phases = [OCCUPATION, REINFORCE, WAR]
+        if random_start:
+            owner = 0
+            keys = list(self.countries)
+            self.rng.shuffle(keys)
+            for key in keys:
+                self.countries[key] = {'owner': str(owner), 'soldiers': 1}
+                self.unassigned_units[str(owner)] -= 1
+                owner = (owner + 1) % num_players
+            self.phases.remove(OCCUPATION)
+        self.phase = self.phases[0]
+        self.current_player = '0'
+        self.turn = 0
+        self.winner = None
+        # moves of AI responses that Game.js would have ignored
+        self.invalid_moves = 0
+
+    # the game a /solve payload is asked about, e.g. to check the moves of a response
+    # before sending them. adj_list is the map's adjacency list, the payload may only
+    # carry its map_id
+    @classmethod
+    def from_payload(cls, data, adj_list):
+        game_map = {'countryName': {city_id: city_id for city_id in data['G']['countries']},
+                    'adjacencyList': {str(city_id): [int(x) for x in adj_list[city_id]] for city_id in adj_list}}
+        game = cls(None, len(data['G']['unassignedUnits']), game_id=data.get('game_id'), game_map=game_map)
+        game.countries = json.loads(json.dumps(data['G']['countries']))
+        game.unassigned_units = dict(data['G']['unassignedUnits'])
+        game.phase = data['ctx']['phase']
+        game.current_player = str(data['ctx']['currentPlayer'])
+        game.turn = data['ctx'].get('turn', 0)
+        return game
+
+    # the request body the client posts to /solve for the player to move
+    def payload(self, agent):
+        data = {
+            'G': {'countries': self.countries, 'unassignedUnits': self.unassigned_units},
+            'ctx': {'currentPlayer': self.current_player, 'phase': self.phase, 'turn': self.turn},
+            'agent': agent,
+            'game_id': self.game_id,
+            'adjacencyList': self.game_map['adjacencyList']
+        }
+        # goes through JSON like the HTTP request, so that agents can't touch the game
+        return json.loads(json.dumps(data))
+
+    def is_over(self):
+        return self.winner is not None
+
+    def occupy_country(self, city_id):
+        city_id = str(city_id)
+        if self.countries[city_id]['owner'] is None and self.unassigned_units[self.current_player] > 0:
+            self.countries[city_id] = {'owner': self.current_player, 'soldiers': 1}
+            self.unassigned_units[self.current_player] -= 1
+            return True
+        return False
+
+    def reinforce_country(self, city_id, num_soldiers):
+        city_id = str(city_id)
+        if (self.countries[city_id]['owner'] == self.current_player and num_soldiers >= 0
+                and self.unassigned_units[self.current_player] >= num_soldiers):
+            self.countries[city_id]['soldiers'] += num_soldiers
+            self.unassigned_units[self.current_player] -= num_soldiers
+            return True
+        return False
+
+    # Game.js trusts the board component to only send attacks on neighbouring
+    # enemy countries, so the board's checks are made here as well
+    def can_attack(self, source_id, dest_id):
+        source, dest = self.countries[source_id], self.countries[dest_id]
+        return (source['owner'] == self.current_player and dest['owner'] != self.current_player
+                and int(dest_id) in self.game_map['adjacencyList'][source_id])
+
+    def attack(self, source_id, dest_id):
+        source_id, dest_id = str(source_id), str(dest_id)
+        if not self.can_attack(source_id, dest_id):
+            return False
+        diff = self.countries[source_id]['soldiers'] - self.countries[dest_id]['soldiers']
+        if diff >= 2:
+            self.countries[source_id]['soldiers'] = 1
+            self.countries[dest_id]['soldiers'] = diff - 1
+            self.countries[dest_id]['owner'] = self.current_player
+            return True
+        return False
+
+    def apply_move(self, move):
+        if self.phase not in ALLOWED_PHASES.get(move['name'], ()):
+            return False
+        if move['name'] == 'occupy':
+            return self.occupy_country(move['sourceId'])
+        elif move['name'] == 'reinforce':
+            return self.reinforce_country(move['sourceId'], int(move['numSoldiers']))
+        elif move['name'] == 'attack':
+            return self.attack(move['sourceId'], move['destId'])
+
+    # plays the moves of one /solve response and ends the turn, like simulateAIMoves
+    def play_response(self, response):
+        moves = json.loads(response).get('moves', []) if response else []
+        for move in moves:
+            try:
+                applied = self.apply_move(move)
+            except (KeyError, ValueError, TypeError):
+                applied = False
+            if not applied:
+                self.invalid_moves += 1
+            self.check_victory()
+            if self.is_over():
+                return
+        self.end_turn()
+
+    # endGameIf of Game.js: a single owner left on the whole map
+    def check_victory(self):
+        owners = set(country['owner'] for country in self.countries.values())
+        if len(owners) == 1 and None not in owners:
+            self.winner = self.current_player
+
+    def phase_ended(self):
+        if self.phase == OCCUPATION:
+            return all(country['owner'] is not None for country in self.countries.values())
+        if self.phase == REINFORCE:
+            return sum(self.unassigned_units.values()) == 0
+        return False
+
+    def end_turn(self):
+        self.turn += 1
+        if self.phase_ended():
+            self.phase = self.phases[self.phases.index(self.phase) + 1]
+            self.current_player = '0'
+        else:
+            self.current_player = self.next_player()
+        if self.phase == WAR:
+            self.begin_war_turn()
+
+    # players without countries are skipped, they can't move anymore
+    def next_player(self):
+        player = int(self.current_player)
+        for step in range(1, self.num_players + 1):
+            candidate = str((player + step) % self.num_players)
+            if self.phase != WAR or self.countries_of(candidate):
+                return candidate
+        return self.current_player
+
+    def countries_of(self, player):
+        return [city_id for city_id in self.countries if self.countries[city_id]['owner'] == player]
+
+    # onTurnBegin of the War phase
+    def begin_war_turn(self):
+        owned = len(self.countries_of(self.current_player))
+        self.unassigned_units[self.current_player] += max(owned // 3, 3)
+
+
+# plays a game to the end, solve(data) is called for every turn with the
+# /solve payload of the player to move and returns the JSON response
+def play(game, agents, solve, max_turns=1000):
+    while not game.is_over() and game.turn < max_turns:
+        agent = agents[int(game.current_player)]
+        game.play_response(solve(game.payload(agent)))
+    return game.winner
@@ -1,20 +1,130 @@
-import itertools
-from heapq import heappush, heappop, heapify
+from functools import cmp_to_key
+
+_REMOVED = object()                          # placeholder for a lazily deleted item
+
 
 class Heap:
+	# indexed binary min-heap: entries can be looked up and updated by a key
 	def __init__(self):
-		self.pq = []                         # list of entries arranged in a heap
+		self.pq = []                         # list of [priority, item, key] entries arranged in a heap
+		self.position = {}                   # maps a key to the index of its entry in pq
+		self.removed = 0                     # number of lazily deleted entries still in pq
+
+	def __len__(self):
+		return len(self.pq) - self.removed
+
+	def contains(self, key):
+		return key in self.position
+
+	def priority(self, key):
+		return self.pq[self.position[key]][0]
+
+	def peek(self):
+		self._discard_removed()
+		if not self.pq:
+			raise IndexError("peek from an empty heap")
+		return self.pq[0][0], self.pq[0][1]
 
 	def pop(self):
-		return heappop(self.pq)
-
-	def decrease_key(self, node, new_value):
-		for idx, _ in enumerate(self.pq):
-			if node.state.equals(self.pq[idx][1].state):
-				self.pq[idx] = (new_value, node)
-				heapify(self.pq)
-				return
-		raise ValueError("element not found")
-
-	def add(self, item, priority=0):
-		return heappush(self.pq, (priority, item))
+		self._discard_removed()
+		if not self.pq:
+			raise IndexError("pop from an empty heap")
+		priority, item, key = self._pop_root()
+		if key is not None:
+			del self.position[key]
+		return priority, item
+
+	def add(self, item, priority=0, key=None):
+		if key is not None and key in self.position:
+			raise ValueError("key already in heap")
+		self.pq.append([priority, item, key])
+		if key is not None:
+			self.position[key] = len(self.pq) - 1
+		self._sift_up(len(self.pq) - 1)
+
+	def decrease_key(self, key, new_value, item=None):
+		if key not in self.position:
+			raise ValueError("element not found")
+		idx = self.position[key]
+		entry = self.pq[idx]
+		if new_value > entry[0]:
+			raise ValueError("new priority is larger than the current one")
+		entry[0] = new_value
+		if item is not None:
+			entry[1] = item
+		self._sift_up(idx)
+
+	def remove(self, key):
+		# the entry stays in pq and is skipped once it reaches the root
+		if key not in self.position:
+			raise ValueError("element not found")
+		entry = self.pq[self.position.pop(key)]
+		entry[1] = _REMOVED
+		entry[2] = None
+		self.removed += 1
+
+	def prune(self, size):
+		# keeps the size entries that would be popped first and drops the others,
+		# returns how many were dropped
+		entries = [entry for entry in self.pq if entry[1] is not _REMOVED]
+		if len(entries) <= size:
+			return 0
+		entries.sort(key=cmp_to_key(lambda a, b: -1 if self._less(a, b) else 1 if self._less(b, a) else 0))
+		dropped = len(entries) - size
+		# a sorted list is a valid heap
+		self.pq = entries[:size]
+		self.position = {entry[2]: idx for idx, entry in enumerate(self.pq) if entry[2] is not None}
+		self.removed = 0
+		return dropped
+
+	def _discard_removed(self):
+		while self.pq and self.pq[0][1] is _REMOVED:
+			self._pop_root()
+			self.removed -= 1
+
+	def _pop_root(self):
+		last = self.pq.pop()
+		if not self.pq:
+			return last
+		root = self.pq[0]
+		self._place(last, 0)
+		self._sift_down(0)
+		return root
+
+	def _place(self, entry, idx):
+		self.pq[idx] = entry
+		if entry[2] is not None:
+			self.position[entry[2]] = idx
+
+	def _less(self, a, b):
+		if a[0] != b[0]:
+			return a[0] < b[0]
+		# on ties, deleted entries go first so they are dropped as early as possible
+		if a[1] is _REMOVED or b[1] is _REMOVED:
+			return a[1] is _REMOVED and b[1] is not _REMOVED
+		return a[1] < b[1]
+
+	def _sift_up(self, idx):
+		entry = self.pq[idx]
+		while idx > 0:
+			parent = (idx - 1) >> 1
+			if not self._less(entry, self.pq[parent]):
+				break
+			self._place(self.pq[parent], idx)
+			idx = parent
+		self._place(entry, idx)
+
+	def _sift_down(self, idx):
+		entry = self.pq[idx]
+		size = len(self.pq)
+		while True:
+			child = 2 * idx + 1
+			if child >= size:
+				break
+			if child + 1 < size and self._less(self.pq[child + 1], self.pq[child]):
+				child += 1
+			if not self._less(self.pq[child], entry):
+				break
+			self._place(self.pq[child], idx)
+			idx = child
+		self._place(entry, idx)
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+# share of the requests that are traced when the payload does not ask for it
+TRACE_SAMPLE = float(os.environ.get('RISK_TRACE_SAMPLE', 0))
+# a traced search logs one event every this many nodes
+TRACE_EVERY = int(os.environ.get('RISK_TRACE_EVERY', 1000))
+
+logger = logging.getLogger('risk.trace')
+
+# the per-request counters, also summed up over all requests
+COUNTERS = ('nodes', 'cutoffs', 'tt_hits', 'tt_misses', 'heuristic_calls', 'depth', 'pruned', 'book_hits')
+PHASES = ('parse', 'reinforce', 'search', 'format')
+
+
+# counters and phase timings of one /solve request. Searches bump the plain
+# attributes, which costs next to nothing, and only a traced request
+# (payload "trace": true, or sampled with RISK_TRACE_SAMPLE) logs events.
+class RequestMetrics:
+    def __init__(self, data):
+        self.agent = data.get('agent')
+        self.phase_name = data.get('ctx', {}).get('phase')
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.trace = bool(data.get('trace')) or (TRACE_SAMPLE > 0 and random.random() < TRACE_SAMPLE)
+        self.events = []
+        self.start = time.perf_counter()
+        self.seconds = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def event(self, kind, **fields):
+        if self.trace:
+            fields.update(event=kind, agent=self.agent, t=round(time.perf_counter() - self.start, 6))
+            self.events.append(fields)
+            logger.info(json.dumps(fields))
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+        self.event('done', seconds=self.seconds, **self.counters)
+        registry.record(self)
+
+    def as_dict(self):
+        return {'agent': self.agent, 'phase': self.phase_name, 'seconds': self.seconds,
+                'counters': dict(self.counters), 'phases': dict(self.phases)}
+
+
+# totals over the requests served by this process, per agent
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.agents = {}
+        self.started = time.time()
+
+    def record(self, metrics):
+        with self.lock:
+            totals = self.agents.get(metrics.agent)
+            if totals is None:
+                totals = self.agents[metrics.agent] = {
+                    'requests': 0, 'traced': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                    'counters': dict.fromkeys(COUNTERS, 0), 'phases': dict.fromkeys(PHASES, 0.0)}
+            totals['requests'] += 1
+            totals['traced'] += metrics.trace
+            totals['seconds'] += metrics.seconds
+            totals['max_seconds'] = max(totals['max_seconds'], metrics.seconds)
+            for name, value in metrics.counters.items():
+                totals['counters'][name] += value
+            for name, value in metrics.phases.items():
+                totals['phases'][name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {'uptime': time.time() - self.started,
+                    'agents': json.loads(json.dumps(self.agents))}
+
+    # the totals in the Prometheus text format
+    def prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+        for agent, totals in sorted(snapshot['agents'].items(), key=lambda item: str(item[0])):
+            label = '{agent="%s"}' % agent
+            lines.append('risk_requests_total%s %d' % (label, totals['requests']))
+            lines.append('risk_request_seconds_total%s %f' % (label, totals['seconds']))
+            for name, value in totals['counters'].items():
+                lines.append('risk_%s_total%s %s' % (name, label, value))
+            for name, value in totals['phases'].items():
+                lines.append('risk_phase_seconds_total{agent="%s",phase="%s"} %f' % (agent, name, value))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.agents = {}
+            self.started = time.time()
+
+
+registry = MetricsRegistry()
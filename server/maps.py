@@ -0,0 +1,27 @@
+import os
+import re
+
+# the maps of client/src/maps, under the names the options page uses
+MAPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'client', 'src', 'maps')
+MAP_FILES = {
+    'World': 'worldmap.js',
+    'USA': 'usmap.js'
+}
+
+_maps = {}
+
+
+# reads the countryName and adjacencyList objects of a client map module,
+# keyed by string ids just like they arrive in a /solve payload
+def load_map(name):
+    if name not in _maps:
+        with open(os.path.join(MAPS_DIR, MAP_FILES[name])) as f:
+            source = f.read()
+        names = source[source.index('countryName'):source.index('adjacencyList')]
+        adjacency = source[source.index('adjacencyList'):]
+        _maps[name] = {
+            'countryName': {city_id: country for city_id, country in re.findall(r'(\d+)\s*:\s*"([^"]*)"', names)},
+            'adjacencyList': {city_id: [int(x) for x in neighbours.split(',') if x.strip()]
+                              for city_id, neighbours in re.findall(r'(\d+)\s*:\s*\[([\d,\s]*)\]', adjacency)}
+        }
+    return _maps[name]
@@ -0,0 +1,200 @@
+import math
+import time
+import numpy as np
+
+# action of a tree edge that ends the turn instead of attacking
+END_TURN = -1
+
+
+# vectorized attack and reinforcement rules of client/src/Game.js
+# over a batch of boards (owner/troops of shape [boards, cities]) on one map
+class Rules:
+    def __init__(self, topology, players):
+        self.topology = topology
+        self.players = np.asarray(players, dtype=np.int32)
+        self.src = topology.sources
+        self.dst = topology.indices
+
+    # edges the player to move of every board may attack along:
+    # the attacker must have at least two troops more than the defender
+    def attack_mask(self, owner, troops, player):
+        player = np.reshape(player, (-1, 1))
+        return ((owner[:, self.src] == player) & (owner[:, self.dst] != player)
+                & (troops[:, self.src] - troops[:, self.dst] >= 2))
+
+    # attacks along one edge per board: the defender dies, one soldier
+    # stays behind and the rest moves into the conquered country
+    def attack(self, owner, troops, rows, edges, player):
+        source, destination = self.src[edges], self.dst[edges]
+        diff = troops[rows, source] - troops[rows, destination]
+        troops[rows, source] = 1
+        troops[rows, destination] = diff - 1
+        owner[rows, destination] = player
+
+    # cities of the player to move that have an opponent neighbour
+    def border_mask(self, owner, player):
+        player = np.reshape(player, (-1, 1))
+        boards, size = owner.shape
+        edges = (owner[:, self.src] == player) & (owner[:, self.dst] != player)
+        segments = (self.src + size * np.arange(boards)[:, None]).ravel()
+        return np.bincount(segments, weights=edges.ravel(), minlength=boards * size).reshape(boards, size) > 0
+
+    # turn start of the War phase: max(countries / 3, 3) new units, placed by the
+    # default policy on the player's strongest border country (ties broken by noise)
+    def reinforce(self, owner, troops, player, noise=None):
+        player = np.reshape(player, (-1, 1))
+        owned = owner == player
+        units = np.maximum(owned.sum(axis=1) // 3, 3)
+        border = self.border_mask(owner, player)
+        score = np.where(border, troops + (noise if noise is not None else 0), -np.inf)
+        rows = np.flatnonzero(border.any(axis=1))
+        troops[rows, score[rows].argmax(axis=1)] += units[rows]
+
+    # the next player in turn order that still owns a country
+    def next_player(self, owner, player):
+        player = np.reshape(player, (-1,))
+        counts = (owner[:, :, None] == self.players[None, None, :]).sum(axis=1)
+        position = np.searchsorted(self.players, player)
+        result = player.copy()
+        found = np.zeros(len(player), dtype=bool)
+        for step in range(1, len(self.players) + 1):
+            candidate = (position + step) % len(self.players)
+            alive = counts[np.arange(len(player)), candidate] > 0
+            pick = alive & ~found
+            result[pick] = self.players[candidate[pick]]
+            found |= pick
+        return result
+
+    def finished(self, owner):
+        return (owner == owner[:, :1]).all(axis=1)
+
+
+class TreeNode:
+    __slots__ = ('owner', 'troops', 'player', 'chooser', 'parent', 'action',
+                 'children', 'untried', 'visits', 'value', 'terminal')
+
+    def __init__(self, owner, troops, player, chooser, parent, action, rules):
+        self.owner = owner
+        self.troops = troops
+        self.player = player        # player to move on this board
+        self.chooser = chooser      # player that picked the edge into this node
+        self.parent = parent
+        self.action = action
+        self.children = []
+        self.visits = 0
+        self.value = 0.0            # sum of playout scores from the chooser's point of view
+        self.terminal = bool(rules.finished(owner[None, :])[0])
+        if self.terminal:
+            self.untried = []
+        else:
+            mask = rules.attack_mask(owner[None, :], troops[None, :], player)[0]
+            edges = np.flatnonzero(mask)
+            # best looking attacks are expanded first, ending the turn last
+            gain = troops[rules.src[edges]] - troops[rules.dst[edges]]
+            self.untried = [END_TURN] + edges[np.argsort(gain, kind='stable')].tolist()
+
+
+# Monte Carlo Tree Search with UCT selection over Game.js rules. Every iteration
+# selects a batch of leaves (with virtual loss so that they differ) and plays them
+# all out at once with the vectorized default policy.
+class MCTS:
+    def __init__(self, compact, players, playouts=2000, deadline=None, exploration=1.4,
+                 leaf_batch=16, rollouts_per_leaf=8, horizon=30, attacks_per_turn=3, seed=None, stop=None):
+        self.rules = Rules(compact.topology, players)
+        self.root_player = compact.player
+        self.playouts = playouts
+        self.deadline = deadline
+        # optional callable that ends the search early when it returns True
+        self.stop = stop
+        self.exploration = exploration
+        self.leaf_batch = leaf_batch
+        self.rollouts_per_leaf = rollouts_per_leaf
+        self.horizon = horizon
+        self.attacks_per_turn = attacks_per_turn
+        self.rng = np.random.default_rng(seed)
+        self.root = TreeNode(compact.owner.copy(), compact.troops.copy(), compact.player,
+                             None, None, None, self.rules)
+        self.playouts_done = 0
+        self.nodes = 1
+
+    # runs the search and returns the most visited root action
+    def run(self):
+        while self.playouts_done < self.playouts:
+            if self.deadline is not None and time.time() > self.deadline:
+                break
+            if self.stop is not None and self.stop():
+                break
+            leaves = [self.select() for _ in range(self.leaf_batch)]
+            scores = self.rollout(leaves)
+            for leaf, leaf_scores in zip(leaves, scores):
+                self.backpropagate(leaf, leaf_scores)
+            self.playouts_done += len(leaves) * self.rollouts_per_leaf
+        if not self.root.children:
+            return END_TURN
+        return max(self.root.children, key=lambda child: child.visits).action
+
+    # descends by UCT to a node with untried actions and expands one of them,
+    # adding a virtual visit on the way so that the next selection avoids this path
+    def select(self):
+        node = self.root
+        node.visits += 1
+        while not node.untried and node.children:
+            log_visits = math.log(node.visits)
+            node = max(node.children, key=lambda child: child.value / max(child.visits, 1)
+                       + self.exploration * math.sqrt(log_visits / max(child.visits, 1)))
+            node.visits += 1
+        if node.untried:
+            node = self.expand(node, node.untried.pop())
+            node.visits += 1
+        return node
+
+    def expand(self, node, action):
+        owner, troops = node.owner.copy(), node.troops.copy()
+        player = node.player
+        if action == END_TURN:
+            player = int(self.rules.next_player(owner[None, :], player)[0])
+            self.rules.reinforce(owner[None, :], troops[None, :], player)
+        else:
+            self.rules.attack(owner[None, :], troops[None, :], np.array([0]), np.array([action]), node.player)
+        child = TreeNode(owner, troops, player, node.player, node, action, self.rules)
+        node.children.append(child)
+        self.nodes += 1
+        return child
+
+    # plays every leaf out rollouts_per_leaf times in one batch, following the
+    # default policy: reinforce the strongest border country, then attack along
+    # the edge with the largest troop advantage a few times, then end the turn.
+    # Returns the root player's share of the countries at the end of each playout.
+    def rollout(self, leaves):
+        copies = self.rollouts_per_leaf
+        owner = np.repeat(np.stack([leaf.owner for leaf in leaves]), copies, axis=0)
+        troops = np.repeat(np.stack([leaf.troops for leaf in leaves]), copies, axis=0)
+        player = np.repeat(np.array([leaf.player for leaf in leaves], dtype=np.int32), copies)
+        done = self.rules.finished(owner)
+        for _ in range(self.horizon):
+            if done.all():
+                break
+            for _ in range(self.attacks_per_turn):
+                mask = self.rules.attack_mask(owner, troops, player) & ~done[:, None]
+                rows = np.flatnonzero(mask.any(axis=1))
+                if not len(rows):
+                    break
+                gain = troops[:, self.rules.src] - troops[:, self.rules.dst]
+                score = np.where(mask, gain + self.rng.random(mask.shape), -np.inf)
+                self.rules.attack(owner, troops, rows, score[rows].argmax(axis=1), player[rows])
+            done |= self.rules.finished(owner)
+            player = self.rules.next_player(owner, player)
+            # finished boards have no border left, so they get no reinforcement
+            self.rules.reinforce(owner, troops, player, self.rng.random(owner.shape))
+        shares = (owner == self.root_player).mean(axis=1)
+        return shares.reshape(len(leaves), copies)
+
+    def backpropagate(self, leaf, scores):
+        total, count = float(scores.sum()), len(scores)
+        node = leaf
+        while node is not None:
+            # one visit of the batch was already added as a virtual visit
+            node.visits += count - 1
+            if node.chooser is not None:
+                node.value += total if node.chooser == self.root_player else count - total
+            node = node.parent
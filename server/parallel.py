@@ -0,0 +1,96 @@
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# number of worker processes used when the request does not ask for a number
+DEFAULT_WORKERS = int(os.environ.get('RISK_WORKERS', 1))
+# processes of the pool shared by all requests, a request asking for more workers gets this many
+POOL_SIZE = int(os.environ.get('RISK_POOL_SIZE', max(os.cpu_count() or 1, DEFAULT_WORKERS)))
+
+_pool = None
+# guards the creation and the shutdown of the pool
+_pool_lock = threading.Lock()
+
+
+def worker_count(data):
+    return min(max(int(data.get('workers', DEFAULT_WORKERS)), 1), POOL_SIZE)
+
+
+# the pool is created on first use and stays warm across requests. It keeps its size,
+# a request caps its parallelism by splitting its work into as many jobs as it has workers
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=POOL_SIZE, mp_context=worker_context())
+        return _pool
+
+
+# workers are not forked from the threaded server: a fork made while another thread
+# holds a lock (of a game session, say) would inherit it held and block on it forever.
+# They come from a fork server instead, which has the search modules imported up front
+# and no other threads, or are spawned where there is no fork server
+def worker_context():
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['batch'])
+    return context
+
+
+# submits fn(*args) for every args in jobs to the pool
+def submit(fn, jobs):
+    pool = get_pool()
+    return [pool.submit(fn, *args) for args in jobs]
+
+
+@atexit.register
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+# deals the root actions out round-robin so that every worker
+# gets some of the actions ranked best by the move ordering
+def split(actions, workers):
+    return [actions[i::workers] for i in range(workers) if actions[i::workers]]
+
+
+# runs in a worker: rebuilds the reinforced root board from the payload
+# and searches the subtrees of the given root actions
+def _minimax_worker(data, actions):
+    from agent import Agent
+    agent = Agent(data, solve=False)
+    agent.reinforce_root()
+    return agent.search_root_actions(actions), agent.nodes_expanded
+
+
+def _informed_worker(data, informed_type, actions):
+    from agent import Agent
+    agent = Agent(data, solve=False)
+    agent.reinforce_root()
+    return agent.search_below_root_actions(informed_type, actions)
+
+
+# minimax values of all root actions, computed by workers that each own a share of them,
+# returns [(action, value, exact)] in the order of actions and the nodes expanded
+def minimax_root(data, actions, workers):
+    futures = submit(_minimax_worker, [(data, share) for share in split(actions, workers)])
+    values, nodes = {}, 0
+    for future in futures:
+        results, expanded = future.result()
+        nodes += expanded
+        for action, value, exact in results:
+            values[action] = (value, exact)
+    return [(action,) + values[action] for action in actions if action in values], nodes
+
+
+# (output, cost, path) of the informed search below every worker's share of the root actions
+def informed_root(data, informed_type, actions, workers):
+    futures = submit(_informed_worker, [(data, informed_type, share) for share in split(actions, workers)])
+    return [future.result() for future in futures]
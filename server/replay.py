@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import argparse
+import threading
+from collections import Counter
+from capture import Corpus
+
+# replays requests captured by capture.py through Agent and profiles them, e.g.
+#   python replay.py captures list
+#   python replay.py captures run --slowest --profiler sample --folded solve.folded
+# The folded stacks are the input of flamegraph.pl and speedscope.
+
+# parts of a request the breakdown reports, as (file, function) pairs,
+# a function of None stands for every function of the file
+HOT_PATHS = [
+    ('deepcopy', [('copy.py', 'deepcopy')]),
+    ('get_opponent_neighbours', [('agent.py', 'get_opponent_neighbours')]),
+    ('Functions.heuristic', [('agent.py', 'heuristic'), ('agent.py', 'compute_heuristic')]),
+    ('Heap', [('heap.py', None)]),
+    ('ai_reinforce', [('agent.py', 'ai_reinforce')]),
+    ('minimax search', [('agent.py', '_maximize'), ('agent.py', '_minimize'), ('agent.py', 'search_root_actions')]),
+    ('informed search', [('agent.py', 'informed_search')]),
+    ('expectiminimax search', [('agent.py', '_expect_choice'), ('agent.py', '_expect_chance')]),
+    ('mcts search', [('mcts.py', None)]),
+    ('turn plan', [('agent.py', 'plan_attacks')]),
+]
+
+
+def hot_path(filename, function):
+    name = os.path.basename(filename)
+    for path, functions in HOT_PATHS:
+        if any(name == file and (func is None or func == function) for file, func in functions):
+            return path
+    return None
+
+
+# samples the stack of a thread every interval seconds from a thread of its own,
+# counting the stacks as tuples of (file, function) from the outermost frame
+class Sampler:
+    def __init__(self, interval=0.001, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = Counter()
+        self.running = False
+
+    def run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append((frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.running = True
+        # the sampler only runs when the profiled thread lets go of the GIL
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switch_interval, self.interval / 2))
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+        sys.setswitchinterval(self.switch_interval)
+
+    # "file:function;file:function count" lines, one per distinct stack
+    def folded(self):
+        return ['%s %d' % (';'.join('%s:%s' % (os.path.basename(file), function) for file, function in stack), count)
+                for stack, count in sorted(self.stacks.items())]
+
+    # {hot path: (inclusive ms, own ms)} of a run that took wall ms
+    def breakdown(self, wall):
+        total = sum(self.stacks.values()) or 1
+        inclusive, own = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            paths = [hot_path(file, function) for file, function in stack]
+            for path in set(paths) - {None}:
+                inclusive[path] += count
+            # own time is spent in the innermost frame itself, like cProfile's tottime
+            if paths[-1] is not None:
+                own[paths[-1]] += count
+        return {path: (inclusive[path] / total * wall, own[path] / total * wall) for path, _ in HOT_PATHS}
+
+
+# {hot path: (inclusive ms, own ms)} from cProfile's stats. The inclusive time counts
+# the calls into a hot path from outside of it, so that recursion is counted once
+def profile_breakdown(stats):
+    inclusive, own = Counter(), Counter()
+    for (file, _, function), (_, _, tottime, _, callers) in stats.stats.items():
+        path = hot_path(file, function)
+        if path is None:
+            continue
+        own[path] += tottime * 1000
+        for (caller_file, _, caller_function), (_, _, _, cumtime) in callers.items():
+            if hot_path(caller_file, caller_function) != path:
+                inclusive[path] += cumtime * 1000
+    return {path: (inclusive[path], own[path]) for path, _ in HOT_PATHS}
+
+
+def print_breakdown(breakdown, wall):
+    print('%-24s %12s %6s %10s %6s' % ('hot path', 'inclusive ms', '%', 'own ms', '%'))
+    for path, (inclusive, own) in breakdown.items():
+        print('%-24s %12.1f %6.1f %10.1f %6.1f' % (path, inclusive, inclusive / wall * 100, own, own / wall * 100))
+
+
+def solve(data):
+    from agent import Agent
+    # the agent gets a copy, the payload is solved again on every repeat. Without its
+    # game_id the search starts without the game's session, like a cold request,
+    # instead of from the tables the warmup and earlier repeats left behind
+    data = json.loads(json.dumps(data))
+    data.pop('game_id', None)
+    return Agent(data).target_list
+
+
+def select(records, args):
+    if args.record is not None:
+        for position, record in enumerate(records):
+            if args.record in (str(position), record['id']):
+                return record
+        raise SystemExit('no record %s' % args.record)
+    return max(records, key=lambda record: record['ms']) if args.slowest else records[-1]
+
+
+def list_records(records):
+    print('%5s %-12s %-16s %-20s %6s %10s' % ('#', 'id', 'agent', 'phase', 'status', 'ms'))
+    for position, record in enumerate(records):
+        data = record['data']
+        print('%5d %-12s %-16s %-20s %6s %10.1f' % (position, record['id'], data.get('agent'), data['ctx']['phase'], record['status'], record['ms']))
+
+
+def run(record, args):
+    data = dict(record['data'])
+    for setting in args.set:
+        key, _, value = setting.partition('=')
+        data[key] = json.loads(value)
+    print('record %s: %s %s, %.1f ms when captured' % (record['id'], data.get('agent'), data['ctx']['phase'], record['ms']))
+    for _ in range(args.warmup):
+        solve(data)
+    if args.profiler == 'cprofile':
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            profile.runcall(solve, data)
+        wall = (time.perf_counter() - start) * 1000
+        stats = pstats.Stats(profile)
+        breakdown = profile_breakdown(stats)
+        if args.pstats:
+            stats.dump_stats(args.pstats)
+    else:
+        with Sampler(args.interval_ms / 1000) as sampler:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                solve(data)
+            wall = (time.perf_counter() - start) * 1000
+        breakdown = sampler.breakdown(wall)
+        if args.folded:
+            with open(args.folded, 'w') as f:
+                f.write('\n'.join(sampler.folded()) + '\n')
+    print('replayed %d times in %.1f ms under %s' % (args.repeat, wall, args.profiler))
+    print_breakdown(breakdown, wall)
+    if args.profiler == 'cprofile' and args.top:
+        stats.sort_stats('tottime').print_stats(args.top)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replays and profiles /solve requests captured with RISK_CAPTURE_DIR')
+    parser.add_argument('corpus', help='the RISK_CAPTURE_DIR of the captures')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='lists the captured requests')
+    replay = commands.add_parser('run', help='replays a captured request under a profiler')
+    replay.add_argument('--record', help='position in list or id of the request, the last one by default')
+    replay.add_argument('--slowest', action='store_true', help='replay the request that took longest')
+    replay.add_argument('--profiler', choices=('cprofile', 'sample'), default='cprofile')
+    replay.add_argument('--interval-ms', type=float, default=1, help='sampling interval of the sample profiler')
+    replay.add_argument('--repeat', type=int, default=1, help='times the request is solved while profiling')
+    replay.add_argument('--warmup', type=int, default=1, help='times the request is solved before profiling, to load the modules, books and models')
+    replay.add_argument('--set', action='append', default=[], metavar='KEY=JSON', help='overrides a payload field, e.g. workers=1')
+    replay.add_argument('--folded', help='write the sampled stacks in the folded format of flamegraph.pl to this file')
+    replay.add_argument('--pstats', help='write the cProfile stats to this file')
+    replay.add_argument('--top', type=int, default=15, help='functions of the cProfile stats listed by own time')
+    args = parser.parse_args(argv)
+
+    corpus = Corpus(args.corpus)
+    records = list(corpus.records())
+    if not records:
+        raise SystemExit('no captured requests in %s' % args.corpus)
+    if args.command == 'list':
+        list_records(records)
+        return
+    corpus.load_maps()
+    run(select(records, args), args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
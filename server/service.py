@@ -0,0 +1,167 @@
+import os
+import time
+import queue
+import threading
+from agent import Agent
+from topology import topology_of
+
+# search threads and the size of every lane's queue
+SERVICE_WORKERS = int(os.environ.get('RISK_SERVICE_WORKERS', 2))
+QUEUE_SIZE = int(os.environ.get('RISK_QUEUE_SIZE', 32))
+# time a request may take from arrival to answer when it does not set deadline_ms
+DEFAULT_DEADLINE_MS = float(os.environ.get('RISK_DEADLINE_MS', 30000))
+# share of what is left of deadline_ms that a search may use, the rest is for answering
+SEARCH_SHARE = 0.9
+
+# agents that answer in a few milliseconds whatever the board
+FAST_AGENTS = ('passive', 'pacifist', 'aggressive')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+EXPIRED = 'expired'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    pass
+
+
+# one /solve request on its way through the service
+class Job:
+    def __init__(self, data, deadline):
+        self.data = data
+        self.deadline = deadline
+        self.key = (data.get('game_id'), str(data['ctx']['currentPlayer'])) if data.get('game_id') is not None else None
+        self.lane = lane_of(data)
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.cancel = threading.Event()
+        self.done = threading.Event()
+        self.submitted = time.time()
+
+    def finish(self, state, result=None, error=None):
+        self.state, self.result, self.error = state, result, error
+        self.done.set()
+
+
+# requests outside of the War phase and the fast agents never wait behind a search
+def lane_of(data):
+    if data['ctx']['phase'] != 'War' or data['agent'] in FAST_AGENTS:
+        return 'fast'
+    return 'search'
+
+
+# runs /solve requests on worker threads behind bounded queues, one queue for the
+# fast lane and one for the searches. A request that is still queued when its
+# deadline passes is dropped, a running search gets what is left of the deadline
+# as its time budget, and a newer request of the same game and player cancels
+# the one it replaces.
+class SolveService:
+    def __init__(self, workers=SERVICE_WORKERS, queue_size=QUEUE_SIZE, default_deadline_ms=DEFAULT_DEADLINE_MS):
+        self.default_deadline_ms = default_deadline_ms
+        self.queues = {'fast': queue.Queue(queue_size), 'search': queue.Queue(queue_size)}
+        self.latest = {}
+        self.running = 0
+        self.counts = {state: 0 for state in (DONE, CANCELLED, EXPIRED, FAILED)}
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.work, args=('fast',), daemon=True)]
+        self.threads += [threading.Thread(target=self.work, args=('search',), daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, data):
+        # an unknown map_id is answered right away, not by a worker
+        topology_of(data)
+        deadline_ms = float(data.get('deadline_ms', self.default_deadline_ms))
+        job = Job(data, time.time() + deadline_ms / 1000)
+        replaced = None
+        with self.lock:
+            if job.key is not None:
+                replaced = self.latest.get(job.key)
+                self.latest[job.key] = job
+        if replaced is not None:
+            replaced.cancel.set()
+            # a replaced request that is still queued is answered without waiting for a worker
+            if replaced.state == QUEUED:
+                self.finish(replaced, CANCELLED)
+        try:
+            self.queues[job.lane].put_nowait(job)
+        except queue.Full:
+            raise QueueFull(job.lane)
+        return job
+
+    # submits the request and waits for its answer: (http status, body)
+    def solve(self, data):
+        try:
+            job = self.submit(data)
+        except QueueFull as e:
+            return 503, {'error': 'queue full', 'lane': e.args[0]}
+        job.done.wait(max(job.deadline - time.time(), 0))
+        if not job.done.is_set():
+            job.cancel.set()
+            return 504, {'error': 'deadline exceeded'}
+        if job.state == DONE:
+            return 200, job.result
+        if job.state == CANCELLED:
+            return 409, {'error': 'replaced by a newer request'}
+        if job.state == EXPIRED:
+            return 504, {'error': 'deadline exceeded'}
+        return 500, {'error': job.error}
+
+    def work(self, lane):
+        while True:
+            job = self.queues[lane].get()
+            try:
+                self.run(job)
+            finally:
+                self.queues[lane].task_done()
+
+    def run(self, job):
+        if job.done.is_set():
+            return
+        if job.cancel.is_set():
+            return self.finish(job, CANCELLED)
+        remaining_ms = (job.deadline - time.time()) * 1000
+        if remaining_ms <= 0:
+            return self.finish(job, EXPIRED)
+        data = job.data
+        # only an explicit deadline turns into a time budget, the default one just bounds
+        # the wait and otherwise lets the agents search the way they do without the service
+        if data.get('deadline_ms') is not None:
+            budget_ms = remaining_ms * SEARCH_SHARE
+            if data.get('time_budget_ms') is None or float(data['time_budget_ms']) > budget_ms:
+                data['time_budget_ms'] = budget_ms
+        job.state = RUNNING
+        with self.lock:
+            self.running += 1
+        try:
+            result = Agent(data, cancel=job.cancel).target_list
+        except Exception as e:
+            return self.finish(job, CANCELLED if job.cancel.is_set() else FAILED, error='%s: %s' % (type(e).__name__, e))
+        finally:
+            with self.lock:
+                self.running -= 1
+        self.finish(job, CANCELLED if job.cancel.is_set() else DONE, result)
+
+    def finish(self, job, state, result=None, error=None):
+        with self.lock:
+            if job.done.is_set():
+                return
+            self.counts[state] += 1
+            if job.key is not None and self.latest.get(job.key) is job:
+                del self.latest[job.key]
+            job.finish(state, result, error)
+
+    def status(self):
+        with self.lock:
+            return {
+                'queued': {lane: q.qsize() for lane, q in self.queues.items()},
+                'queue_size': {lane: q.maxsize for lane, q in self.queues.items()},
+                'running': self.running,
+                'workers': len(self.threads),
+                'games': len(self.latest),
+                'finished': dict(self.counts)
+            }
@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from transposition import TranspositionTable, Entry
+
+# sessions kept at most, the least recently used one goes first
+MAX_SESSIONS = int(os.environ.get('RISK_SESSIONS', 64))
+# memory all sessions together may hold
+SESSION_MEMORY_MB = float(os.environ.get('RISK_SESSION_MEMORY_MB', 256))
+# sessions not used for this long are dropped
+SESSION_IDLE_S = float(os.environ.get('RISK_SESSION_IDLE_S', 600))
+# slots of a session's transposition table, smaller than a request's own table
+# since it lives on between requests
+SESSION_TABLE_SIZE = 1 << 15
+
+# approximate sizes used to keep the sessions within SESSION_MEMORY_MB
+ENTRY_BYTES = sys.getsizeof(Entry(0, 0, 0.0, 0, None)) + 120
+
+
+# what a game's searches keep from one turn to the next. The transposition
+# table holds the values and best moves of the boards searched last turn, so
+# when the next request's root is one of them (or leads into them) the search
+# starts from the stored subtree instead of from scratch.
+class Session:
+    def __init__(self, key):
+        self.key = key
+        self.transpositions = TranspositionTable(SESSION_TABLE_SIZE)
+        self.history = {}
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self.requests = 0
+        # ctx.turn of the last request, the requests of one turn share its tables
+        self.turn = None
+
+    # called at the start of every search of the session. A new turn (or a request
+    # that sends no ctx.turn) starts a new search generation and decays the history
+    def begin(self, turn=None):
+        self.requests += 1
+        self.last_used = time.time()
+        if turn is not None and turn == self.turn:
+            return
+        self.turn = turn
+        self.transpositions.new_search()
+        # older cutoffs count half as much as the ones of this turn
+        for action in self.history:
+            self.history[action] //= 2
+
+    def nbytes(self):
+        return 8 * self.transpositions.size + ENTRY_BYTES * self.transpositions.filled + 100 * len(self.history)
+
+
+# the sessions of the games in progress, by (game_id, player, agent)
+class SessionCache:
+    def __init__(self, max_sessions=MAX_SESSIONS, memory_mb=SESSION_MEMORY_MB, idle_s=SESSION_IDLE_S):
+        self.max_sessions = max_sessions
+        self.memory = memory_mb * 1024 * 1024
+        self.idle_s = idle_s
+        self.sessions = OrderedDict()
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    # the session of the request, locked for the caller until checkin,
+    # None for requests that do not send a game_id
+    def checkout(self, data):
+        if data.get('game_id') is None:
+            return None
+        key = (str(data['game_id']), str(data['ctx']['currentPlayer']), data['agent'])
+        with self.lock:
+            self.evict_idle()
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = Session(key)
+            self.sessions.move_to_end(key)
+        # a replaced request of the same game may still be winding down
+        session.lock.acquire()
+        session.begin(data['ctx'].get('turn'))
+        return session
+
+    def checkin(self, session):
+        session.last_used = time.time()
+        session.lock.release()
+        with self.lock:
+            self.evict()
+
+    def evict_idle(self):
+        now = time.time()
+        for key in [key for key, session in self.sessions.items() if now - session.last_used > self.idle_s]:
+            self.drop(key)
+
+    # drops the least recently used sessions until the count and the memory fit
+    def evict(self):
+        self.evict_idle()
+        total = sum(session.nbytes() for session in self.sessions.values())
+        while self.sessions and (len(self.sessions) > self.max_sessions or total > self.memory):
+            key = next(iter(self.sessions))
+            total -= self.sessions[key].nbytes()
+            self.drop(key)
+
+    def drop(self, key):
+        del self.sessions[key]
+        self.evicted += 1
+
+    def status(self):
+        with self.lock:
+            return {'sessions': len(self.sessions), 'evicted': self.evicted,
+                    'bytes': sum(session.nbytes() for session in self.sessions.values())}
+
+
+sessions = SessionCache()
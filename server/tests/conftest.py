@@ -0,0 +1,21 @@
+import os
+import sys
+import random
+import pytest
+
+# the server modules import each other by plain name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine
+
+
+# a War board of the World map, every city held by one of two players
+# with 1 to 30 troops, as the client would post it to /solve
+@pytest.fixture
+def war_payload():
+    rng = random.Random(7)
+    data = engine.Game('World', random_start=True, seed=7, game_id='test').payload('minimax')
+    for country in data['G']['countries'].values():
+        country['soldiers'] = rng.randint(1, 30)
+    data['ctx']['phase'] = engine.WAR
+    return data
@@ -0,0 +1,11 @@
+import batch
+
+
+def test_every_board_gets_one_result_shape(war_payload):
+    unknown = dict(war_payload, adjacencyList=None, map_id='unknown')
+    failing = dict(war_payload, agent='no such agent')
+    results = batch.solve_batch({'boards': [dict(war_payload, agent='aggressive'), unknown, failing], 'workers': 1})
+    solved, missing, failed = results
+    assert solved['ok'] and solved['result']['moves'] and solved['result']['map_id']
+    assert missing == {'ok': False, 'error': 'unknown map_id', 'map_id': 'unknown', 'status': 404}
+    assert not failed['ok'] and failed['status'] == 500
@@ -0,0 +1,38 @@
+import pytest
+import book
+import engine
+from agent import State
+
+
+def occupation_state(seed):
+    return State(engine.Game('World', seed=seed, game_id='test').payload('greedy'))
+
+
+def test_lookup_finds_the_written_boards(tmp_path):
+    state = occupation_state(0)
+    free = state.dict_player_cities[None]
+    topology = state.topology
+    book.write(str(tmp_path / ('%s.book' % topology.map_id)), topology.map_id,
+               {book.position_key(state): topology.sorted_index[free[3]]})
+    shelf = book.BookShelf(str(tmp_path))
+    assert book.lookup(state, shelf) == free[3]
+    # the same board with the other player to move is another position
+    state.current_player = '1'
+    assert book.lookup(state, shelf) is None
+
+
+def test_lookup_misses_on_a_city_the_rules_do_not_allow(tmp_path):
+    state = occupation_state(0)
+    topology = state.topology
+    taken = next(iter(state.dict_city_troops))
+    state.dict_city_owner[taken] = '1'
+    book.write(str(tmp_path / ('%s.book' % topology.map_id)), topology.map_id,
+               {book.position_key(state): topology.sorted_index[taken]})
+    assert book.lookup(state, book.BookShelf(str(tmp_path))) is None
+
+
+def test_book_of_another_map(tmp_path):
+    path = str(tmp_path / 'other.book')
+    book.write(path, 'other', {1: 2})
+    with pytest.raises(book.BookError):
+        book.Book(path, 'mine')
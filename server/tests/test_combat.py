@@ -0,0 +1,21 @@
+import pytest
+import combat
+
+
+def test_single_dice_battle():
+    # two attackers roll one die against one defender, who wins ties
+    assert combat.outcome(2, 1) == pytest.approx((15 / 36, 21 / 36, 15 / 36, 2, 1))
+
+
+def test_larger_battles_are_scaled_to_the_built_tables():
+    exact = combat._outcome(120, 100, 128)
+    scaled = combat._outcome(120, 100, 64)
+    assert abs(exact[0] - scaled[0]) < 0.05
+    assert abs(exact[1] - scaled[1]) / exact[1] < 0.15
+
+
+def test_outcome_never_builds_tables():
+    combat.prepare(0)
+    built = combat.tables.cache_info().currsize
+    combat.outcome(combat.MAX_TABLE_TROOPS * 4, combat.MAX_TABLE_TROOPS * 3)
+    assert combat.tables.cache_info().currsize == built
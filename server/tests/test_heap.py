@@ -0,0 +1,25 @@
+import random
+from heap import Heap
+
+
+def test_pops_in_priority_order_after_decrease_key():
+    rng = random.Random(0)
+    heap, priorities = Heap(), {}
+    for key in range(200):
+        priorities[key] = rng.random()
+        heap.add(key, priority=priorities[key], key=key)
+    for key in range(0, 200, 3):
+        priorities[key] -= 0.5
+        heap.decrease_key(key, priorities[key])
+    popped = [heap.pop() for _ in range(len(heap))]
+    assert popped == sorted((priority, key) for key, priority in priorities.items())
+
+
+def test_prune_keeps_the_cheapest_entries():
+    heap = Heap()
+    for key in range(10):
+        heap.add(key, priority=10 - key, key=key)
+    heap.remove(9)
+    assert heap.prune(3) == 6
+    assert [heap.pop()[1] for _ in range(len(heap))] == [8, 7, 6]
+    assert not heap.contains(0)
@@ -0,0 +1,28 @@
+import engine
+from agent import Agent
+from sessions import SessionCache, sessions
+
+
+def request(turn, phase=engine.WAR):
+    return {'game_id': 'g', 'agent': 'minimax', 'ctx': {'currentPlayer': '0', 'phase': phase, 'turn': turn}}
+
+
+def test_history_decays_once_per_turn():
+    cache = SessionCache()
+    session = cache.checkout(request(4))
+    session.history['a_b'] = 8
+    generation = session.transpositions.generation
+    cache.checkin(session)
+    # another request of the same turn, e.g. a retry, keeps the tables as they are
+    session = cache.checkout(request(4))
+    assert session.history['a_b'] == 8 and session.transpositions.generation == generation
+    cache.checkin(session)
+    session = cache.checkout(request(6))
+    assert session.history['a_b'] == 4 and session.transpositions.generation == generation + 1
+    cache.checkin(session)
+
+
+def test_opening_requests_leave_the_session_alone():
+    game = engine.Game('World', seed=3, game_id='opening-session')
+    Agent(game.payload('minimax'))
+    assert not any(key[0] == 'opening-session' for key in sessions.sessions)
@@ -0,0 +1,60 @@
+import copy
+import random
+import zobrist
+from agent import State
+
+
+def snapshot(state):
+    return copy.deepcopy((state.dict_city_troops, state.dict_city_owner, state.dict_player_cities,
+                          state.opponent_adj_list, state.border_cities, state.city_order, state.next_order,
+                          state.unassigned_units, state.hash))
+
+
+# an attack of the current player on a neighbouring opponent city
+def random_attack(state, rng):
+    attacks = [(city_id, target) for city_id in state.dict_player_cities[state.current_player]
+               for target in state.opponent_adj_list.get(city_id, [])]
+    return rng.choice(attacks) if attacks else None
+
+
+def test_undo_restores_the_board_and_its_hash(war_payload):
+    state = State(war_payload)
+    rng = random.Random(0)
+    snapshots = []
+    for _ in range(300):
+        attack = random_attack(state, rng) if rng.random() < 0.6 or not snapshots else None
+        if attack is not None:
+            snapshots.append(snapshot(state))
+            if rng.random() < 0.7:
+                state.apply_attack(*attack)
+            else:
+                state.apply_repulse(attack[0], attack[1], 1, rng.randint(1, 5))
+        else:
+            state.undo()
+            assert snapshot(state) == snapshots.pop()
+        # the incremental hash always agrees with the hash of the board from scratch
+        assert state.hash == zobrist.board_hash(state.dict_city_owner, state.dict_city_troops)
+    while snapshots:
+        state.undo()
+        assert snapshot(state) == snapshots.pop()
+
+
+def test_borders_follow_captures(war_payload):
+    state = State(war_payload)
+    rng = random.Random(1)
+    for _ in range(20):
+        attack = random_attack(state, rng)
+        if attack is None:
+            break
+        state.apply_attack(*attack)
+        assert state.border_cities == state.get_border_cities()
+        assert state.opponent_adj_list == state.get_opponent_neighbours()
+
+
+def test_hash_covers_exact_troop_counts(war_payload):
+    hashes = set()
+    city_id = next(iter(war_payload['G']['countries']))
+    for troops in (62, 63, 70, 200):
+        war_payload['G']['countries'][city_id]['soldiers'] = troops
+        hashes.add(State(war_payload).hash)
+    assert len(hashes) == 4
@@ -0,0 +1,25 @@
+import pytest
+from topology import MapRegistry, UnknownMap
+
+
+def ring(size, offset):
+    return {str(i): [str((i + 1) % size + offset)] for i in range(offset, offset + size)}
+
+
+def test_registering_a_map_again_returns_its_topology():
+    registry = MapRegistry(capacity=2)
+    topology = registry.register(ring(3, 0))
+    assert registry.register(ring(3, 0)) is topology
+    assert registry.get(topology.map_id) is topology
+
+
+def test_evicted_maps_are_unknown():
+    registry = MapRegistry(capacity=2)
+    first = registry.register(ring(3, 0))
+    second = registry.register(ring(3, 10))
+    # the least recently used map goes first
+    registry.get(first.map_id)
+    registry.register(ring(3, 20))
+    assert registry.get(first.map_id) is first
+    with pytest.raises(UnknownMap):
+        registry.get(second.map_id)
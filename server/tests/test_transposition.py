@@ -0,0 +1,47 @@
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+
+
+def test_exact_values_decide_any_window():
+    table = TranspositionTable(16)
+    table.store(5, 3, 0.25, EXACT)
+    entry = table.probe(5)
+    assert table.cutoff(entry, 3, -1, 1) == 0.25
+    assert table.cutoff(entry, 2, 0.5, 1) == 0.25
+
+
+def test_bounds_only_decide_outside_the_window():
+    table = TranspositionTable(16)
+    table.store(1, 3, 0.5, LOWER)
+    table.store(2, 3, -0.5, UPPER)
+    lower, upper = table.probe(1), table.probe(2)
+    # a lower bound at or above beta is a cutoff, below it is not
+    assert table.cutoff(lower, 3, 0, 0.5) == 0.5
+    assert table.cutoff(lower, 3, 0, 0.75) is None
+    # an upper bound at or below alpha is a cutoff, above it is not
+    assert table.cutoff(upper, 3, -0.5, 0) == -0.5
+    assert table.cutoff(upper, 3, -0.75, 0) is None
+
+
+def test_shallower_entries_do_not_decide():
+    table = TranspositionTable(16)
+    table.store(1, 2, 0.25, EXACT)
+    assert table.cutoff(table.probe(1), 3, -1, 1) is None
+    assert table.cutoff(None, 0, -1, 1) is None
+
+
+def test_probe_checks_the_full_hash():
+    table = TranspositionTable(16)
+    table.store(3, 1, 0.1, EXACT)
+    assert table.probe(3 + 16) is None
+    assert (table.hits, table.misses) == (0, 1)
+
+
+def test_deeper_entries_keep_their_slot_within_a_search():
+    table = TranspositionTable(16)
+    table.store(3, 4, 0.1, EXACT, move='a_b')
+    table.store(3 + 16, 2, 0.2, EXACT)
+    assert table.probe(3).value == 0.1
+    # left over from an older search, the entry gives way
+    table.new_search()
+    table.store(3 + 16, 2, 0.2, EXACT)
+    assert table.probe(3 + 16).value == 0.2
@@ -0,0 +1,57 @@
+import json
+import pytest
+import wire
+from topology import topology_of
+
+
+def decoded_board(data):
+    return {city_id: (country['owner'], country['soldiers']) for city_id, country in data['G']['countries'].items()}
+
+
+def test_full_board_round_trip(war_payload):
+    topology = topology_of(war_payload)
+    war_payload['time_budget_ms'] = 200
+    body = wire.Encoder(topology).encode(war_payload)
+    data = wire.decode_request(body, wire.BoardCache())
+    assert decoded_board(data) == {str(k): (v['owner'], v['soldiers']) for k, v in war_payload['G']['countries'].items()}
+    assert data['ctx'] == war_payload['ctx']
+    assert data['agent'] == war_payload['agent']
+    assert data['game_id'] == war_payload['game_id']
+    assert data['map_id'] == topology.map_id
+    assert data['time_budget_ms'] == 200
+    assert data['G']['unassignedUnits'] == {str(k): v for k, v in war_payload['G']['unassignedUnits'].items()}
+
+
+def test_delta_round_trip(war_payload):
+    topology = topology_of(war_payload)
+    encoder, cache = wire.Encoder(topology), wire.BoardCache()
+    wire.decode_request(encoder.encode(war_payload), cache)
+    city_id, target = list(war_payload['G']['countries'])[:2]
+    war_payload['G']['countries'][city_id]['soldiers'] += 5
+    war_payload['G']['countries'][target]['owner'] = None
+    body = encoder.encode(war_payload)
+    assert wire.HEADER.unpack_from(body)[2] & wire.FLAG_DELTA
+    data = wire.decode_request(body, cache)
+    assert decoded_board(data) == {str(k): (v['owner'], v['soldiers']) for k, v in war_payload['G']['countries'].items()}
+
+
+def test_delta_against_an_unknown_board(war_payload):
+    topology = topology_of(war_payload)
+    encoder = wire.Encoder(topology)
+    encoder.encode(war_payload)
+    with pytest.raises(wire.UnknownBase):
+        wire.decode_request(encoder.encode(war_payload), wire.BoardCache())
+
+
+def test_response_round_trip(war_payload):
+    topology = topology_of(war_payload)
+    city_id, target = topology.sorted_ids[:2]
+    response = {'moves': [{'name': 'reinforce', 'sourceId': city_id, 'destId': 0, 'numSoldiers': 3},
+                          {'name': 'attack', 'sourceId': city_id, 'destId': target, 'numSoldiers': 2}],
+                'map_id': topology.map_id}
+    assert wire.decode_response(wire.encode_response(json.dumps(response))) == response
+
+
+def test_rejects_other_formats():
+    with pytest.raises(wire.WireError):
+        wire.decode_request(b'JSON' + bytes(wire.HEADER.size), wire.BoardCache())
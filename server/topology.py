@@ -0,0 +1,135 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# maps kept by the registry before the least recently used one is dropped
+MAP_CACHE_SIZE = int(os.environ.get('RISK_MAP_CACHE', 16))
+
+
+# raised for a map_id the registry does not (or no longer) know,
+# the client then has to send the adjacencyList again
+class UnknownMap(KeyError):
+    pass
+
+
+# static description of a map: city ids interned to integers
+# and the adjacency list stored in CSR form (indptr/indices)
+class Topology:
+    def __init__(self, adj_list, map_id=None):
+        self.map_id = map_id if map_id is not None else adjacency_hash(adj_list)
+        self.ids = []
+        self.index = {}
+        for city_id in adj_list:
+            self.intern(city_id)
+        # neighbours that are missing from the keys get no edges of their own
+        for city_id in adj_list:
+            for neighbour_id in adj_list[city_id]:
+                self.intern(neighbour_id)
+        self.size = len(self.ids)
+
+        counts = np.zeros(self.size, dtype=np.int32)
+        indices = []
+        for city_id in adj_list:
+            counts[self.index[str(city_id)]] = len(adj_list[city_id])
+            indices.extend(self.index[str(x)] for x in adj_list[city_id])
+        self.indptr = np.zeros(self.size + 1, dtype=np.int32)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.indices = np.array(indices, dtype=np.int32)
+        # source city of every edge, aligned with indices
+        self.sources = np.repeat(np.arange(self.size, dtype=np.int32), counts)
+        self.degrees = counts
+        # the adjacency list with string ids, shared by every State of this map
+        self.adj_list = {str(city_id): [str(x) for x in adj_list[city_id]] for city_id in adj_list}
+        self.reverse_adj_list = {}
+        for city_id in self.adj_list:
+            for neighbour_id in self.adj_list[city_id]:
+                self.reverse_adj_list.setdefault(neighbour_id, []).append(city_id)
+        self._sorted_ids = None
+
+    # maps never change, so copies of a State share their topology
+    def __deepcopy__(self, memo):
+        return self
+
+    def intern(self, city_id):
+        city_id = str(city_id)
+        if city_id not in self.index:
+            self.index[city_id] = len(self.ids)
+            self.ids.append(city_id)
+        return self.index[city_id]
+
+    def neighbours(self, idx):
+        return self.indices[self.indptr[idx]:self.indptr[idx + 1]]
+
+    def degree(self):
+        return self.degrees
+
+    # the city ids in an order that does not depend on the order the map was
+    # registered in, numerical for numeric ids. Boards sent in the wire format
+    # list their cities in this order
+    @property
+    def sorted_ids(self):
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.ids, key=lambda city_id: (not city_id.isdigit(), int(city_id) if city_id.isdigit() else 0, city_id))
+            self._sorted_index = {city_id: idx for idx, city_id in enumerate(self._sorted_ids)}
+        return self._sorted_ids
+
+    # position of every city id in sorted_ids
+    @property
+    def sorted_index(self):
+        self.sorted_ids
+        return self._sorted_index
+
+
+# id of a map: a hash of its adjacency list, independent of the key order
+# and of whether the ids are sent as numbers or strings
+def adjacency_hash(adj_list):
+    canonical = ','.join(sorted('%s:%s' % (city_id, ' '.join(map(str, neighbours)))
+                                for city_id, neighbours in adj_list.items()))
+    return hashlib.blake2b(canonical.encode(), digest_size=8).hexdigest()
+
+
+# the topologies of the maps seen lately, by map id, least recently used first
+class MapRegistry:
+    def __init__(self, capacity=MAP_CACHE_SIZE):
+        self.capacity = capacity
+        self.maps = OrderedDict()
+        # requests of several threads register and look up maps at the same time
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.maps)
+
+    def register(self, adj_list):
+        map_id = adjacency_hash(adj_list)
+        with self.lock:
+            if map_id in self.maps:
+                self.maps.move_to_end(map_id)
+                return self.maps[map_id]
+        # built outside of the lock, a map registered meanwhile by another request is kept
+        topology = Topology(adj_list, map_id)
+        with self.lock:
+            topology = self.maps.setdefault(map_id, topology)
+            self.maps.move_to_end(map_id)
+            while len(self.maps) > self.capacity:
+                self.maps.popitem(last=False)
+        return topology
+
+    def get(self, map_id):
+        with self.lock:
+            if map_id not in self.maps:
+                raise UnknownMap(map_id)
+            self.maps.move_to_end(map_id)
+            return self.maps[map_id]
+
+
+registry = MapRegistry()
+
+
+# topology of the map of a /solve payload, which either sends
+# the adjacencyList or the map_id of a map sent before
+def topology_of(data):
+    if data.get('adjacencyList') is not None:
+        return registry.register(data['adjacencyList'])
+    return registry.get(data.get('map_id'))
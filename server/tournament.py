@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+import json
+import argparse
+import multiprocessing
+import numpy as np
+import engine
+from maps import MAP_FILES
+from agent import Agent
+
+# pits two agents against each other for a number of headless games, e.g.
+#   python tournament.py minimax greedy --games 100 --processes 4
+
+
+def solver(options, latencies):
+    def solve(data):
+        data.update(options)
+        start = time.perf_counter()
+        response = Agent(data).target_list
+        latencies[data['agent']].append(time.perf_counter() - start)
+        return response
+    return solve
+
+
+# runs in a worker process: one game, the agents swap seats on every other game
+def play_game(args):
+    index, agents, settings = args
+    if index % 2:
+        agents = agents[::-1]
+    game = engine.Game(settings['map'], random_start=settings['random_start'], seed=settings['seed'] + index)
+    latencies = {agent: [] for agent in agents}
+    start = time.perf_counter()
+    error = None
+    try:
+        winner = engine.play(game, agents, solver(settings['options'], latencies), settings['max_turns'])
+    except Exception as e:
+        # an agent that crashes loses the game
+        winner = str(1 - int(game.current_player))
+        error = '%s: %s' % (type(e).__name__, e)
+    return {
+        'game': index,
+        'seats': agents,
+        'winner': agents[int(winner)] if winner is not None else None,
+        'turns': game.turn,
+        'invalid_moves': game.invalid_moves,
+        'seconds': time.perf_counter() - start,
+        'latencies': latencies,
+        'error': error
+    }
+
+
+def percentiles(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None}
+    p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+    return {'p50': p50, 'p95': p95, 'p99': p99}
+
+
+def summarize(agents, results, seconds):
+    report = {'games': len(results), 'seconds': seconds, 'games_per_sec': len(results) / seconds,
+              'draws': sum(1 for result in results if result['winner'] is None),
+              'errors': [result['error'] for result in results if result['error']], 'agents': {}}
+    for agent in agents:
+        latencies = [latency for result in results for latency in result['latencies'].get(agent, [])]
+        wins = sum(1 for result in results if result['winner'] == agent)
+        report['agents'][agent] = dict(wins=wins, win_rate=wins / max(len(results), 1),
+                                       moves=len(latencies), latency_ms=percentiles(latencies))
+    return report
+
+
+def print_report(report):
+    print('%d games in %.1fs (%.2f games/sec), %d draws, %d errors'
+          % (report['games'], report['seconds'], report['games_per_sec'], report['draws'], len(report['errors'])))
+    print('%-16s %6s %8s %8s %10s %10s %10s' % ('agent', 'wins', 'win rate', 'moves', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for agent, stats in report['agents'].items():
+        latency = stats['latency_ms']
+        print('%-16s %6d %8.2f %8d %10s %10s %10s' % (
+            agent, stats['wins'], stats['win_rate'], stats['moves'],
+            *['-' if latency[p] is None else '%.1f' % latency[p] for p in ('p50', 'p95', 'p99')]))
+    for error in report['errors']:
+        print('error:', error)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless AI vs AI games on the rules of client/src/Game.js')
+    parser.add_argument('agents', nargs=2, help='agent names, as in Agent.agents')
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--map', default='World', choices=sorted(MAP_FILES))
+    parser.add_argument('--random-start', action='store_true', help='skip the occupation phase like startWithRandomCountries')
+    parser.add_argument('--max-turns', type=int, default=1000, help='games still running after this many turns are draws')
+    parser.add_argument('--time-budget-ms', type=float, help='time_budget_ms sent with every request')
+    parser.add_argument('--plan-turn', action='store_true', help='send plan_turn, so that the agents play a chain of attacks per turn')
+    parser.add_argument('--no-book', action='store_true', help='send "book": false, so that the agents play the opening without the opening books')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the report and every game result to this file')
+    args = parser.parse_args(argv)
+
+    valid = Agent(engine.Game(args.map).payload(None), solve=False).agents
+    options = {'workers': 1}
+    if args.time_budget_ms is not None:
+        options['time_budget_ms'] = args.time_budget_ms
+    if args.plan_turn:
+        options['plan_turn'] = True
+    if args.no_book:
+        options['book'] = False
+    settings = dict(map=args.map, random_start=args.random_start, seed=args.seed,
+                    max_turns=args.max_turns, options=options)
+    for agent in args.agents:
+        if agent not in valid:
+            parser.error('unknown agent %s' % agent)
+
+    jobs = [(index, args.agents, settings) for index in range(args.games)]
+    start = time.perf_counter()
+    if args.processes > 1:
+        with multiprocessing.Pool(args.processes) as pool:
+            results = list(pool.imap_unordered(play_game, jobs))
+    else:
+        results = [play_game(job) for job in jobs]
+    report = summarize(list(dict.fromkeys(args.agents)), sorted(results, key=lambda result: result['game']),
+                       time.perf_counter() - start)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(report, results=results), f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# bound types of stored minimax values
+EXACT = 0
+LOWER = 1   # the value is a lower bound (a beta cutoff happened)
+UPPER = 2   # the value is an upper bound (no move raised alpha)
+
+# slots of a table when no size is given
+TABLE_SIZE = 1 << 16
+
+
+class Entry:
+    __slots__ = ('hash', 'depth', 'value', 'flag', 'move', 'generation')
+
+    def __init__(self, board_hash, depth, value, flag, move, generation=0):
+        self.hash = board_hash
+        self.depth = depth
+        self.value = value
+        self.flag = flag
+        self.move = move
+        self.generation = generation
+
+
+# fixed-size table of search results keyed by Zobrist hash, a slot keeps the entry
+# that was searched to the larger depth unless it is left over from an older search
+class TranspositionTable:
+    def __init__(self, size=TABLE_SIZE):
+        self.size = size
+        self.slots = [None] * size
+        self.hits = 0
+        self.misses = 0
+        # slots in use, and the search the entries are stored by, see new_search
+        self.filled = 0
+        self.generation = 0
+
+    def probe(self, board_hash):
+        entry = self.slots[board_hash % self.size]
+        if entry is not None and entry.hash == board_hash:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, board_hash, depth, value, flag=EXACT, move=None):
+        idx = board_hash % self.size
+        entry = self.slots[idx]
+        if entry is None:
+            self.filled += 1
+        if entry is None or depth >= entry.depth or entry.generation != self.generation:
+            self.slots[idx] = Entry(board_hash, depth, value, flag, move, self.generation)
+        elif entry.hash == board_hash and move is not None and entry.move is None:
+            entry.move = move
+
+    # the stored value if it decides the node searched
+    # to the given depth within the (alpha, beta) window
+    def cutoff(self, entry, depth, alpha, beta):
+        if entry is None or entry.depth < depth:
+            return None
+        if entry.flag == EXACT:
+            return entry.value
+        if entry.flag == LOWER and entry.value >= beta:
+            return entry.value
+        if entry.flag == UPPER and entry.value <= alpha:
+            return entry.value
+        return None
+
+    # a table kept for the next search still answers probes with
+    # the old entries, but they no longer win their slot by depth
+    def new_search(self):
+        self.generation += 1
+
+    def clear(self):
+        self.slots = [None] * self.size
+        self.filled = 0
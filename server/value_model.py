@@ -0,0 +1,260 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import multiprocessing
+import numpy as np
+import engine
+import bsr
+from maps import MAP_FILES, load_map
+from compact import CompactState, NO_OWNER
+from topology import topology_of
+
+# a learned value of a board for the searches, in place of Problem.eval and of
+# total_BSR for the greedy search. A small network (or a linear model) reads
+# per-city features of the board, seen from the player to move, and predicts
+# the outcome of the game in [-1, 1] like Problem.eval does. Models are fitted
+# per map on self-play games (python value_model.py --map World) and picked
+# with "evaluator": "learned" in the payload.
+
+# where the server looks for models and the trainer writes them
+MODEL_DIR = os.environ.get('RISK_MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+# BSR values from here upwards count as fully exposed
+BSR_CAP = 10.0
+
+
+# the feature rows of a batch of boards of one map, owner and troops as in
+# CompactState ([boards, cities]), players the player every board is seen from.
+# Per city: owned, log troops if owned, log troops of an opponent, owned and on
+# the border, BSR if owned and BSR of an opponent city. Then the shares of the
+# cities and troops the player holds
+def features(topology, owner, troops, players):
+    owner, troops = np.atleast_2d(owner), np.atleast_2d(troops)
+    players = np.reshape(players, (-1, 1))
+    mine = owner == players
+    theirs = (owner != players) & (owner != NO_OWNER)
+    log_troops = np.log1p(np.maximum(troops, 0))
+    values, is_border = bsr.bsr(topology, owner, troops)
+    ratios = np.minimum(values, BSR_CAP) / BSR_CAP
+    cities = np.stack([mine, mine * log_troops, theirs * log_troops, mine & is_border, mine * ratios, theirs * ratios], axis=2)
+    owned = (mine | theirs).sum(axis=1)
+    my_troops, all_troops = (troops * mine).sum(axis=1), (troops * (mine | theirs)).sum(axis=1)
+    shares = np.stack([mine.sum(axis=1) / np.maximum(owned, 1), my_troops / np.maximum(all_troops, 1)], axis=1)
+    return np.concatenate([cities.reshape(len(owner), -1), shares], axis=1)
+
+
+class ValueModel:
+    def __init__(self, map_id, mean, scale, w1, b1, w2, b2):
+        self.map_id = map_id
+        self.mean, self.scale = mean, scale
+        self.w1, self.b1, self.w2, self.b2 = w1, b1, w2, b2
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(str(arrays['map_id']), *(arrays[name] for name in ('mean', 'scale', 'w1', 'b1', 'w2', 'b2')))
+
+    def save(self, path):
+        np.savez(path, map_id=self.map_id, mean=self.mean, scale=self.scale, w1=self.w1, b1=self.b1, w2=self.w2, b2=self.b2)
+
+    # a model without a hidden layer is linear in the features
+    def hidden(self, x):
+        z = (x - self.mean) / self.scale
+        return np.tanh(z @ self.w1 + self.b1) if self.w1.shape[1] else z
+
+    def predict(self, x):
+        return np.tanh(self.hidden(x) @ self.w2 + self.b2)
+
+    def score(self, topology, owner, troops, players):
+        return self.predict(features(topology, owner, troops, players))
+
+    # the values of the children of one board, each given as the list of
+    # (city index, owner, troops) entries in which it differs from the parent,
+    # like bsr.total_bsr_children
+    def score_children(self, compact, changes):
+        boards = len(changes)
+        owner = np.repeat(compact.owner[None, :], boards, axis=0)
+        troops = np.repeat(compact.troops[None, :], boards, axis=0)
+        for row, changed in enumerate(changes):
+            for idx, city_owner, city_troops in changed:
+                owner[row, idx] = city_owner
+                troops[row, idx] = city_troops
+        return self.score(compact.topology, owner, troops, np.full(boards, compact.player))
+
+
+# the models of the maps, loaded on first use. A map without a model is
+# remembered as such, so that its requests don't look for one on disk again
+class ModelShelf:
+    def __init__(self, directory=MODEL_DIR):
+        self.directory = directory
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def get(self, map_id):
+        if map_id not in self.models:
+            with self.lock:
+                if map_id not in self.models:
+                    path = os.path.join(self.directory, '%s.npz' % map_id)
+                    self.models[map_id] = ValueModel.load(path) if os.path.exists(path) else None
+        return self.models[map_id]
+
+
+models = ModelShelf()
+
+
+# the leaf evaluator of a request backed by a map's model: evaluate scores the
+# board of a State, score_children all children of a node in one batch
+class LearnedEvaluator:
+    def __init__(self, model):
+        self.model = model
+
+    def evaluate(self, state):
+        compact = state.to_compact()
+        return float(self.model.score(compact.topology, compact.owner, compact.troops, compact.player)[0])
+
+    def score_children(self, compact, changes):
+        return self.model.score_children(compact, changes)
+
+
+# evaluators by the payload's "evaluator", "heuristic" (the default) keeps Problem.eval
+EVALUATORS = {'learned': LearnedEvaluator}
+
+
+# the evaluator a request asks for, None for the built-in Problem.eval
+# or when there is no model of the map
+def evaluator_for(data, topology, shelf=models):
+    evaluator = EVALUATORS.get(data.get('evaluator', 'heuristic'))
+    if evaluator is None:
+        return None
+    model = shelf.get(topology.map_id)
+    return evaluator(model) if model is not None else None
+
+
+# training. Self-play games of the given agents are played through engine.Game,
+# every War board is kept from the side of both players and labelled with the
+# result of the game for that player: 1 for a win, -1 for a loss, 0 for a draw.
+
+def play_game(args):
+    from agent import Agent
+    index, agents, settings = args
+    game = engine.Game(settings['map'], random_start=True, seed=settings['seed'] + index)
+    boards = []
+
+    def solve(data):
+        if data['ctx']['phase'] == engine.WAR:
+            compact = CompactState(data)
+            boards.append((compact.owner, compact.troops))
+        data.update(settings['options'])
+        return Agent(data).target_list
+    winner = engine.play(game, agents, solve, settings['max_turns'])
+    return index, boards, winner, game.num_players
+
+
+def self_play(map_name, agents, games, options, max_turns, processes, seed=0, log=print):
+    pairs = [(a, b) for a in agents for b in agents]
+    settings = dict(map=map_name, options=options, max_turns=max_turns, seed=seed)
+    jobs = [(index, list(pairs[index % len(pairs)]), settings) for index in range(games)]
+    owner, troops, players, labels, game_index = [], [], [], [], []
+    start = time.perf_counter()
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            results = list(pool.imap_unordered(play_game, jobs))
+    else:
+        results = [play_game(job) for job in jobs]
+    for index, boards, winner, num_players in sorted(results, key=lambda result: result[0]):
+        for player in range(num_players):
+            label = 0.0 if winner is None else 1.0 if str(player) == winner else -1.0
+            for board_owner, board_troops in boards:
+                owner.append(board_owner)
+                troops.append(board_troops)
+                players.append(player)
+                labels.append(label)
+                game_index.append(index)
+    log('%d games, %d boards in %.1fs' % (games, len(labels), time.perf_counter() - start))
+    return np.array(owner), np.array(troops), np.array(players), np.array(labels), np.array(game_index)
+
+
+# fits the weights by full batch gradient descent with Adam on the squared error
+def fit(x, y, hidden=16, epochs=500, learning_rate=0.01, l2=0.01, seed=0):
+    rng = np.random.default_rng(seed)
+    mean, scale = x.mean(axis=0), x.std(axis=0)
+    scale[scale == 0] = 1
+    z = (x - mean) / scale
+    params = [rng.normal(0, 1 / np.sqrt(z.shape[1]), (z.shape[1], hidden)), np.zeros(hidden),
+              rng.normal(0, 1 / np.sqrt(max(hidden, z.shape[1])), hidden if hidden else z.shape[1]), np.zeros(())]
+    moments = [np.zeros_like(p) for p in params]
+    squares = [np.zeros_like(p) for p in params]
+    for step in range(1, epochs + 1):
+        w1, b1, w2, b2 = params
+        h = np.tanh(z @ w1 + b1) if hidden else z
+        out = np.tanh(h @ w2 + b2)
+        # gradient of the mean squared error through the output tanh
+        delta = 2 * (out - y) * (1 - out ** 2) / len(y)
+        grads = [None, None, h.T @ delta + l2 * w2, delta.sum()]
+        if hidden:
+            delta_h = np.outer(delta, w2) * (1 - h ** 2)
+            grads[0], grads[1] = z.T @ delta_h + l2 * w1, delta_h.sum(axis=0)
+        else:
+            grads[0], grads[1] = np.zeros_like(w1), np.zeros_like(b1)
+        for i, grad in enumerate(grads):
+            moments[i] = 0.9 * moments[i] + 0.1 * grad
+            squares[i] = 0.999 * squares[i] + 0.001 * grad ** 2
+            params[i] = params[i] - learning_rate * (moments[i] / (1 - 0.9 ** step)) / (np.sqrt(squares[i] / (1 - 0.999 ** step)) + 1e-8)
+    return mean, scale, params
+
+
+# mean squared error and the share of decided games whose winner the values get right
+def report(values, labels):
+    decided = labels != 0
+    accuracy = float(np.mean(np.sign(values[decided]) == labels[decided])) if decided.any() else float('nan')
+    return float(np.mean((values - labels) ** 2)), accuracy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fits the value model of a map on self-play games')
+    parser.add_argument('--map', default='World', choices=sorted(MAP_FILES))
+    parser.add_argument('--agents', nargs='+', default=['greedy', 'aggressive', 'pacifist'], help='agents playing the self-play games, every pair of them in turn')
+    parser.add_argument('--games', type=int, default=40)
+    parser.add_argument('--max-turns', type=int, default=300, help='games still running after this many turns are draws')
+    parser.add_argument('--time-budget-ms', type=float, default=50, help='time_budget_ms of the self-play requests')
+    parser.add_argument('--hidden', type=int, default=16, help='units of the hidden layer, 0 fits a linear model')
+    parser.add_argument('--epochs', type=int, default=500)
+    parser.add_argument('--learning-rate', type=float, default=0.01)
+    parser.add_argument('--l2', type=float, default=0.01)
+    parser.add_argument('--validation', type=float, default=0.2, help='share of the games held out to validate the model')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data', help='.npz file of self-play boards, read when it exists and else written, so that models can be refitted without playing again')
+    parser.add_argument('--out', default=MODEL_DIR, help='directory the model is written to')
+    args = parser.parse_args(argv)
+
+    topology = topology_of({'adjacencyList': load_map(args.map)['adjacencyList']})
+    options = {'workers': 1, 'time_budget_ms': args.time_budget_ms}
+    if args.data and os.path.exists(args.data):
+        with np.load(args.data) as arrays:
+            owner, troops, players, labels, game_index = (arrays[name] for name in ('owner', 'troops', 'players', 'labels', 'game_index'))
+        args.games = int(game_index.max()) + 1
+    else:
+        owner, troops, players, labels, game_index = self_play(args.map, args.agents, args.games, options,
+                                                               args.max_turns, args.processes, args.seed)
+        if args.data:
+            np.savez(args.data, owner=owner, troops=troops, players=players, labels=labels, game_index=game_index)
+    x = features(topology, owner, troops, players)
+    held_out = game_index >= args.games * (1 - args.validation)
+    mean, scale, params = fit(x[~held_out], labels[~held_out], args.hidden, args.epochs, args.learning_rate, args.l2, args.seed)
+    model = ValueModel(topology.map_id, mean, scale, *params)
+    # Problem.eval of the same boards, from the city and troop shares at the end of the features
+    heuristic = 2 * (0.9 * x[:, -2] + 0.1 * x[:, -1]) - 1
+    for name, rows in (('train', ~held_out), ('validation', held_out)):
+        if rows.any():
+            print('%-10s %6d boards  model mse %.3f acc %.3f  Problem.eval mse %.3f acc %.3f' % (
+                (name, rows.sum()) + report(model.predict(x[rows]), labels[rows]) + report(heuristic[rows], labels[rows])))
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, '%s.npz' % topology.map_id)
+    model.save(path)
+    print('model written to %s' % path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
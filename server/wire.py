@@ -0,0 +1,237 @@
+import os
+import json
+import struct
+import threading
+from collections import OrderedDict
+import numpy as np
+from engine import OCCUPATION, REINFORCE, WAR
+from topology import registry
+
+# a binary alternative to the JSON /solve payload for clients that post many
+# boards, e.g. simulated games. A request names its map by map_id and packs the
+# owner and troops of every city, or with a game_id only of the cities that
+# changed since the game's previous request. Integers are little endian.
+#
+# request:
+#   header   4s magic, u8 version, u8 flags, u8 phase, u8 current player, u32 seq, u32 base
+#   strings  map_id, agent and game_id, each a u8 byte length and UTF-8
+#   units    u8 players, then u16 unassigned units per player
+#   options  u16 byte length and a JSON object of the other payload fields (time_budget_ms, ...)
+#            and of the ctx's turn, as "turn"
+#   board    full: i8 owner (-1 for none) of every city, then u16 troops of every city
+#            delta (FLAG_DELTA): u16 count, then u16 positions, i8 owners and u16 troops
+#            of the cities that changed since the board numbered base
+# response:
+#   u16 moves, then u8 name, u16 source, u16 destination, u16 soldiers per move, map_id
+#
+# Cities are given by their position in topology.sorted_ids, NO_CITY stands
+# for the 0 that the JSON moves send where there is no city.
+
+CONTENT_TYPE = 'application/x-risk-board'
+RESPONSE_CONTENT_TYPE = 'application/x-risk-moves'
+MAGIC = b'RSK1'
+VERSION = 1
+FLAG_DELTA = 1
+HEADER = struct.Struct('<4sBBBBII')
+MOVE = struct.Struct('<BHHH')
+NO_CITY = 0xFFFF
+PHASES = (OCCUPATION, REINFORCE, WAR)
+MOVE_NAMES = ('occupy', 'reinforce', 'attack', "can't find any moves")
+# payload fields that have a place of their own in the request
+FIELDS = ('G', 'ctx', 'agent', 'game_id', 'map_id', 'adjacencyList')
+# games whose last board is kept for the deltas of their next request
+BOARD_CACHE_SIZE = int(os.environ.get('RISK_BOARD_CACHE', 256))
+
+
+# a request or response that does not follow the format
+class WireError(ValueError):
+    pass
+
+
+# a delta against a board the server does not have (anymore),
+# the client then sends the full board again
+class UnknownBase(KeyError):
+    pass
+
+
+# the last board of every game, by game_id, least recently used first
+class BoardCache:
+    def __init__(self, capacity=BOARD_CACHE_SIZE):
+        self.capacity = capacity
+        self.boards = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.boards)
+
+    def get(self, game_id, map_id, seq):
+        with self.lock:
+            board = self.boards.get(game_id)
+            if board is None or board[0] != map_id or board[1] != seq:
+                raise UnknownBase(game_id)
+            self.boards.move_to_end(game_id)
+            return board[2].copy(), board[3].copy()
+
+    def put(self, game_id, map_id, seq, owners, troops):
+        with self.lock:
+            self.boards[game_id] = (map_id, seq, owners, troops)
+            self.boards.move_to_end(game_id)
+            while len(self.boards) > self.capacity:
+                self.boards.popitem(last=False)
+
+
+boards = BoardCache()
+
+
+class Reader:
+    def __init__(self, body):
+        self.body = memoryview(body)
+        self.offset = 0
+
+    def take(self, size):
+        if self.offset + size > len(self.body):
+            raise WireError('truncated')
+        chunk = self.body[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def unpack(self, fmt):
+        return struct.unpack(fmt, self.take(struct.calcsize(fmt)))
+
+    def string(self):
+        size, = self.unpack('<B')
+        return bytes(self.take(size)).decode()
+
+    def array(self, dtype, count):
+        dtype = np.dtype(dtype).newbyteorder('<')
+        return np.frombuffer(self.take(dtype.itemsize * count), dtype=dtype)
+
+
+def pack_string(value):
+    data = ('' if value is None else str(value)).encode()
+    if len(data) > 255:
+        raise WireError('string too long')
+    return struct.pack('<B', len(data)) + data
+
+
+# the /solve payload a binary request stands for, as the JSON request would have
+# carried it. Raises UnknownMap for a map the registry does not know and
+# UnknownBase for a delta against a board the server does not have.
+def decode_request(body, cache=boards):
+    reader = Reader(body)
+    magic, version, flags, phase, player, seq, base = reader.unpack(HEADER.format)
+    if magic != MAGIC or version != VERSION:
+        raise WireError('not a version %d board' % VERSION)
+    if phase >= len(PHASES):
+        raise WireError('unknown phase %d' % phase)
+    map_id, agent, game_id = reader.string(), reader.string(), reader.string() or None
+    topology = registry.get(map_id)
+    players, = reader.unpack('<B')
+    units = reader.array('u2', players).tolist()
+    size, = reader.unpack('<H')
+    options = json.loads(bytes(reader.take(size)).decode()) if size else {}
+
+    count = topology.size
+    if flags & FLAG_DELTA:
+        if game_id is None:
+            raise WireError('a delta needs a game_id')
+        owners, troops = cache.get(game_id, map_id, base)
+        changed, = reader.unpack('<H')
+        positions = reader.array('u2', changed)
+        if changed and positions.max() >= count:
+            raise WireError('city position out of range')
+        owners[positions] = reader.array('i1', changed)
+        troops[positions] = reader.array('u2', changed)
+    else:
+        owners, troops = reader.array('i1', count).copy(), reader.array('u2', count).copy()
+    if reader.offset != len(reader.body):
+        raise WireError('trailing bytes')
+    if game_id is not None:
+        cache.put(game_id, map_id, seq, owners, troops)
+
+    countries = {city_id: {'owner': str(owner) if owner >= 0 else None, 'soldiers': soldiers}
+                 for city_id, owner, soldiers in zip(topology.sorted_ids, owners.tolist(), troops.tolist())}
+    data = dict(options)
+    turn = data.pop('turn', None)
+    data.update({
+        'G': {'countries': countries, 'unassignedUnits': {str(idx): value for idx, value in enumerate(units)}},
+        'ctx': {'currentPlayer': str(player), 'phase': PHASES[phase]},
+        'agent': agent,
+        'game_id': game_id,
+        'map_id': map_id
+    })
+    if turn is not None:
+        data['ctx']['turn'] = turn
+    return data
+
+
+# packs the JSON response of an agent (Agent.target_list)
+def encode_response(solution):
+    response = json.loads(solution)
+    topology = registry.get(response['map_id'])
+    index = topology.sorted_index
+    moves = response.get('moves', [])
+    chunks = [struct.pack('<H', len(moves))]
+    for move in moves:
+        name = MOVE_NAMES.index(move['name'])
+        source = index[str(move['sourceId'])] if name < 3 else NO_CITY
+        destination = index[str(move['destId'])] if move['name'] == 'attack' else NO_CITY
+        chunks.append(MOVE.pack(name, source, destination, int(move['numSoldiers'])))
+    chunks.append(pack_string(response['map_id']))
+    return b''.join(chunks)
+
+
+# the response as the JSON path would have answered it, as a dict
+def decode_response(body):
+    reader = Reader(body)
+    count, = reader.unpack('<H')
+    moves = [MOVE.unpack(reader.take(MOVE.size)) for _ in range(count)]
+    map_id = reader.string()
+    ids = registry.get(map_id).sorted_ids
+    return {'moves': [{'name': MOVE_NAMES[name],
+                       'sourceId': ids[source] if source != NO_CITY else 0,
+                       'destId': ids[destination] if destination != NO_CITY else 0,
+                       'numSoldiers': soldiers} for name, source, destination, soldiers in moves],
+            'map_id': map_id}
+
+
+# packs the requests of one game for a client, as deltas against the game's
+# previous request once there is one. Call reset() when the server answers
+# that it does not know the base board anymore.
+class Encoder:
+    def __init__(self, topology):
+        self.topology = topology
+        self.seq = 0
+        self.last = None
+
+    def reset(self):
+        self.last = None
+
+    def encode(self, data):
+        ids = self.topology.sorted_ids
+        countries = data['G']['countries']
+        owners = np.array([-1 if countries[city_id]['owner'] is None else int(countries[city_id]['owner'])
+                           for city_id in ids], dtype='<i1')
+        troops = np.array([countries[city_id]['soldiers'] for city_id in ids], dtype='<u2')
+        game_id = data.get('game_id')
+        delta = game_id is not None and self.last is not None
+        units = data['G']['unassignedUnits']
+        options = {key: value for key, value in data.items() if key not in FIELDS}
+        if 'turn' in data['ctx']:
+            options['turn'] = data['ctx']['turn']
+        options = json.dumps(options, separators=(',', ':')).encode() if options else b''
+        chunks = [
+            HEADER.pack(MAGIC, VERSION, FLAG_DELTA if delta else 0, PHASES.index(data['ctx']['phase']),
+                        int(data['ctx']['currentPlayer']), self.seq + 1, self.seq),
+            pack_string(self.topology.map_id), pack_string(data['agent']), pack_string(game_id),
+            struct.pack('<B', len(units)), np.array([units[str(idx)] for idx in range(len(units))], dtype='<u2').tobytes(),
+            struct.pack('<H', len(options)), options
+        ]
+        if delta:
+            changed = np.flatnonzero((owners != self.last[0]) | (troops != self.last[1])).astype('<u2')
+            chunks += [struct.pack('<H', len(changed)), changed.tobytes(), owners[changed].tobytes(), troops[changed].tobytes()]
+        else:
+            chunks += [owners.tobytes(), troops.tobytes()]
+        self.seq += 1
+        self.last = (owners, troops)
+        return b''.join(chunks)
@@ -0,0 +1,26 @@
+from functools import lru_cache
+from hashlib import blake2b
+
+# xor-ed into the hash of positions where the minimizing side is to move
+SIDE_KEY = 0x9e3779b97f4a7c15
+
+# keys kept by the memo of key, a long running server sees every troop count of
+# every map, so only the most recently used keys are kept
+KEY_CACHE_SIZE = 1 << 16
+
+
+# random 64-bit key of a city holding a number of troops for an owner,
+# derived from the triple itself so that hashes agree across processes.
+# Troop counts are hashed exactly, so boards that differ in any count
+# also differ in their hash
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def key(city_id, owner, troops):
+    triple = (str(city_id), owner, troops)
+    return int.from_bytes(blake2b(repr(triple).encode(), digest_size=8).digest(), 'little')
+
+
+def board_hash(dict_city_owner, dict_city_troops):
+    board = 0
+    for city_id in dict_city_troops:
+        board ^= key(city_id, dict_city_owner.get(city_id), dict_city_troops[city_id])
+    return board